@@ -0,0 +1,171 @@
+import heapq
+from collections import defaultdict
+
+from sqlalchemy import insert, select
+
+from dormitory import app, db, hashing
+from dormitory.counters import add_residents
+from dormitory.models import Dorm, Room, Student
+from dormitory.search import index
+
+POLICIES = ("floors", "majors")
+
+# Hash method for allocated accounts, which all start with the default
+# password; logins upgrade them to PASSWORD_HASH_METHOD.
+app.config.setdefault("ALLOCATE_PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+
+class Allocator:
+    """Assign beds to a cohort in one pass over an in-memory free-bed index.
+
+    Rooms with free beds are kept in one heap per dorm; dorms are grouped
+    by gender and tried in id order unless a student asks for a dorm.
+
+    ``floors`` fills the lowest floors first, topping up partly occupied
+    rooms before opening empty ones. ``majors`` opens the emptiest rooms
+    and keeps filling each with students of the same major and grade.
+    """
+
+    def __init__(self, policy="floors"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}.")
+        self.policy = policy
+        self.free = {}
+        self.level = {}
+        self.heaps = defaultdict(list)
+        self.dorms = defaultdict(list)
+        self.groups = defaultdict(list)
+
+        rows = db.session.execute(
+            select(Room.id, Room.dorm_id, Room.level, Room.spaces - Room.residents)
+            .where(Room.spaces > Room.residents)
+            .order_by(Room.dorm_id, Room.id)
+        )
+        for room_id, dorm_id, level, free in rows:
+            self.free[room_id] = free
+            self.level[room_id] = level
+            self.heaps[dorm_id].append((self._key(room_id), room_id))
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+        for dorm_id, gender in db.session.execute(
+            select(Dorm.id, Dorm.gender).order_by(Dorm.id)
+        ):
+            if dorm_id in self.heaps:
+                self.dorms[gender].append(dorm_id)
+
+    def _key(self, room_id):
+        if self.policy == "floors":
+            return self.level[room_id], self.free[room_id]
+        return -self.free[room_id], self.level[room_id]
+
+    def _pop(self, dorm_id):
+        heap = self.heaps[dorm_id]
+        return heapq.heappop(heap)[1] if heap else None
+
+    def _take(self, room_id, dorm_id, group):
+        self.free[room_id] -= 1
+        if not self.free[room_id]:
+            return
+        if self.policy == "majors":
+            self.groups[group].append((room_id, dorm_id))
+        else:
+            heapq.heappush(self.heaps[dorm_id], (self._key(room_id), room_id))
+
+    def _grouped(self, group, dorm_id=None):
+        # A bed in a partly filled room of ``group``, in ``dorm_id`` if given.
+        rooms = self.groups[group]
+        for i in range(len(rooms) - 1, -1, -1):
+            if dorm_id is None or rooms[i][1] == dorm_id:
+                room_id, room_dorm = rooms.pop(i)
+                self._take(room_id, room_dorm, group)
+                return room_id
+        return None
+
+    def _fresh(self, group, dorms):
+        for dorm in dorms:
+            room_id = self._pop(dorm)
+            if room_id is not None:
+                self._take(room_id, dorm, group)
+                return room_id
+        return None
+
+    def _shared(self, gender, dorm_id=None):
+        # Once the heaps are empty, top up the rooms of other groups rather
+        # than leave their beds unused.
+        for group in list(self.groups):
+            if group[0] == gender:
+                room_id = self._grouped(group, dorm_id)
+                if room_id is not None:
+                    return room_id
+        return None
+
+    def assign(self, gender, major=None, grade=None, dorm_id=None):
+        """Return the room for one student, or None if no bed fits."""
+        dorms = self.dorms.get(gender, [])
+        group = (gender, major, grade)
+        room_id = None
+        if dorm_id in dorms:
+            # The requested dorm while it has a bed, then any other.
+            room_id = self._grouped(group, dorm_id)
+            if room_id is None:
+                room_id = self._fresh(group, [dorm_id])
+            if room_id is None:
+                room_id = self._shared(gender, dorm_id)
+        if room_id is None:
+            room_id = self._grouped(group)
+        if room_id is None:
+            room_id = self._fresh(group, dorms)
+        if room_id is None:
+            room_id = self._shared(gender)
+        return room_id
+
+
+def allocate(cohort, policy="floors", password="12345678"):
+    """Place every student in ``cohort`` and insert them in one transaction.
+
+    Each student is a dict with the Student columns except ``room_id``,
+    plus ``gender`` and an optional preferred ``dorm_id``. Returns the
+    inserted rows and the students that could not be placed.
+    """
+    allocator = Allocator(policy)
+    ids = [s["id"] for s in cohort]
+    existing = set()
+    for i in range(0, len(ids), 500):
+        existing.update(
+            db.session.scalars(
+                select(Student.id).where(Student.id.in_(ids[i : i + 500]))
+            )
+        )
+
+    placed, unplaced = [], []
+    for student in cohort:
+        room_id = None
+        if student["id"] not in existing:
+            room_id = allocator.assign(
+                student["gender"],
+                student["major"],
+                student["grade"],
+                student.get("dorm_id"),
+            )
+        if room_id is None:
+            unplaced.append(student)
+            continue
+        existing.add(student["id"])
+        row = {k: v for k, v in student.items() if k not in ("gender", "dorm_id")}
+        row["room_id"] = room_id
+        placed.append(row)
+
+    if placed:
+        hashes = hashing.generate_many(
+            [password] * len(placed), app.config["ALLOCATE_PASSWORD_HASH_METHOD"]
+        )
+        for row, password_hash in zip(placed, hashes):
+            row["password_hash"] = password_hash
+        db.session.execute(insert(Student), placed)
+        index(db.session, "student", placed)
+        residents = defaultdict(int)
+        for row in placed:
+            residents[row["room_id"]] += 1
+        add_residents(db.session, residents)
+    db.session.commit()
+    return placed, unplaced
@@ -0,0 +1,178 @@
+import csv
+import gzip
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import Response, request, stream_with_context
+from flask_login import current_user, login_required
+from sqlalchemy import delete, select
+
+from dormitory import app, db, tables
+from dormitory.exports import MIMETYPES, csv_chunks
+from dormitory.models import Student, Visitor
+from dormitory.search import unindex
+
+# Closed visits that began more than this many days ago are archived.
+app.config.setdefault("VISITOR_RETENTION_DAYS", 180)
+app.config.setdefault(
+    "VISITOR_ARCHIVE_DIR", os.path.join(app.instance_path, "archive", "visitors")
+)
+# Visits moved per transaction.
+app.config.setdefault("VISITOR_ARCHIVE_BATCH_SIZE", 5000)
+
+COLUMNS = Visitor.__table__.columns.keys()
+INTEGERS = {"id", "dorm_id"}
+DATETIMES = {"visit_time", "leave_time"}
+MONTH = re.compile(r"\d{4}-\d{2}")
+
+
+def _path(month):
+    return os.path.join(app.config["VISITOR_ARCHIVE_DIR"], f"{month}.csv.gz")
+
+
+def months():
+    """Archived months as ``YYYY-MM``, oldest first."""
+    try:
+        names = os.listdir(app.config["VISITOR_ARCHIVE_DIR"])
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-7] for name in names if MONTH.fullmatch(name[:-7]))
+
+
+def _append(month, rows):
+    path = _path(month)
+    new = not os.path.exists(path)
+    with open(path, "ab") as raw:
+        # Every batch is a gzip member of its own, read back as one stream.
+        with gzip.open(raw, "wt", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(COLUMNS)
+            writer.writerows(rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def archive(before, batch_size=None):
+    """Move closed visits that began before ``before`` into monthly gzipped
+    CSV files, a batch per transaction, and return how many were moved.
+
+    A batch is on disk before it is deleted, so a failed commit can only
+    leave visits archived twice, which ``search`` skips.
+    """
+    batch_size = batch_size or app.config["VISITOR_ARCHIVE_BATCH_SIZE"]
+    os.makedirs(app.config["VISITOR_ARCHIVE_DIR"], exist_ok=True)
+    moved = 0
+    while True:
+        batch = db.session.execute(
+            select(Visitor.__table__)
+            .where(Visitor.visit_time < before, Visitor.leave_time.is_not(None))
+            .order_by(Visitor.visit_time, Visitor.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return moved
+        by_month = defaultdict(list)
+        for row in batch:
+            by_month[row.visit_time.strftime("%Y-%m")].append(row)
+        for month, rows in by_month.items():
+            _append(month, rows)
+        ids = [row.id for row in batch]
+        db.session.execute(delete(Visitor).where(Visitor.id.in_(ids)))
+        unindex(db.session, "visitor", ids)
+        db.session.commit()
+        moved += len(batch)
+
+
+def _parse(record):
+    visit = {}
+    for name, value in record.items():
+        if value == "":
+            value = None
+        elif name in INTEGERS:
+            value = int(value)
+        elif name in DATETIMES:
+            value = datetime.fromisoformat(value)
+        visit[name] = value
+    return visit
+
+
+def search(since=None, until=None, **filters):
+    """Yield archived visits as dicts, in the order they were archived.
+
+    Only months from ``since`` to ``until`` (``YYYY-MM``, inclusive) are
+    read, and only visits whose columns equal ``filters`` are kept.
+    """
+    filters = {name: str(value) for name, value in filters.items()}
+    seen = set()
+    for month in months():
+        if since and month < since or until and month > until:
+            continue
+        with gzip.open(_path(month), "rt", encoding="utf-8", newline="") as f:
+            for record in csv.DictReader(f):
+                if record["id"] in seen or any(
+                    record[name] != value for name, value in filters.items()
+                ):
+                    continue
+                seen.add(record["id"])
+                yield _parse(record)
+
+
+def _month(value):
+    if not MONTH.fullmatch(value):
+        raise ValueError(value)
+    return value
+
+
+@app.route("/archive/visitors.csv")
+@login_required
+def archived_visitors():
+    """Archived visits of the student, or of the manager's dorm, optionally
+    limited to the ``since`` and ``until`` months."""
+    if current_user.__class__ == Student:
+        filters = {"student_id": current_user.id}
+    else:
+        filters = {"dorm_id": current_user.dorm_id}
+    visits = search(
+        request.args.get("since", type=_month),
+        request.args.get("until", type=_month),
+        **filters,
+    )
+    titles = tables.VISITORS.titles
+    rows = ([visit[name] for name, _ in titles] for visit in visits)
+    return Response(
+        stream_with_context(csv_chunks(titles, rows)),
+        mimetype=MIMETYPES["csv"],
+        headers={"Content-Disposition": "attachment; filename=visitors-archive.csv"},
+    )
+
+
+@app.cli.command("archive-visitors")
+@click.option("--days", type=int, help="Retention, defaults to VISITOR_RETENTION_DAYS.")
+@click.option("--batch-size", type=int, help="Visits moved per transaction.")
+def archive_visitors(days, batch_size):
+    """Move old closed visits from the database to the archive."""
+    if days is None:
+        days = app.config["VISITOR_RETENTION_DAYS"]
+    moved = archive(datetime.now() - timedelta(days=days), batch_size)
+    click.echo(f"{moved} visits archived.")
+
+
+@app.cli.command("search-visitors")
+@click.option("--dorm", "dorm_id", type=int)
+@click.option("--student", "student_id")
+@click.option("--since", help="First month, YYYY-MM.")
+@click.option("--until", help="Last month, YYYY-MM.")
+def search_visitors(dorm_id, student_id, since, until):
+    """Print archived visits as CSV."""
+    filters = {}
+    if dorm_id is not None:
+        filters["dorm_id"] = dorm_id
+    if student_id is not None:
+        filters["student_id"] = student_id
+    writer = csv.DictWriter(click.get_text_stream("stdout"), COLUMNS)
+    writer.writeheader()
+    writer.writerows(search(since, until, **filters))
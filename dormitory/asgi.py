@@ -0,0 +1,204 @@
+"""Opt-in async serving, e.g. ``uvicorn dormitory.asgi:application``.
+
+GET and HEAD requests to ``ASYNC_ENDPOINTS`` are served on the event loop.
+The Flask view runs unchanged in a greenlet whose database round trips go
+through an async driver, so while one request waits on the database the
+loop serves the others. Every other request goes to the WSGI app on a
+thread.
+
+Needs asgiref, greenlet and the async driver of the database: aiomysql for
+MySQL or aiosqlite for SQLite.
+"""
+
+import os
+import sys
+from collections import defaultdict
+from io import BytesIO
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from dormitory import app, db
+from dormitory.routing import SAFE_METHODS, RoutingSession, engine_options
+
+# Read-heavy views served on the event loop.
+app.config.setdefault(
+    "ASYNC_ENDPOINTS",
+    (
+        "index",
+        "dorm_info",
+        "info",
+        "report",
+        "visit",
+        "manage",
+        "room_info",
+        "moves_manage",
+        "fix",
+        "search_view",
+    ),
+)
+
+# Async driver per backend.
+DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def async_url(url):
+    """``url`` with the async driver of its backend."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{DRIVERS[backend]}")
+
+
+def environ(scope):
+    """A WSGI environ for the ASGI http ``scope``, with an empty body."""
+    root = scope.get("root_path", "").encode().decode("latin1")
+    path = scope["path"].encode().decode("latin1")
+    if path.startswith(root):
+        path = path[len(root) :]
+    server = scope.get("server") or ("localhost", 80)
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root,
+        "PATH_INFO": path,
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        env["REMOTE_ADDR"] = scope["client"][0]
+    headers = defaultdict(list)
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        headers[name].append(value.decode("latin1"))
+    for name, values in headers.items():
+        env[name] = ("; " if name == "HTTP_COOKIE" else ",").join(values)
+    return env
+
+
+class AsyncRoutingSession(RoutingSession):
+    """A RoutingSession that picks the primary or a replica as usual, then
+    runs on the async twin of that engine. The ``sync_session_class`` of
+    the AsyncSession of each async request."""
+
+    def __init__(self, engines, **kwargs):
+        super().__init__(db, **kwargs)
+        self._async_engines = engines
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        return self._async_engines[engine].sync_engine
+
+
+def _dispatch(db_session, env):
+    # Runs in the greenlet of AsyncSession.run_sync, so the whole request,
+    # rendering included, sees ``db_session`` as ``db.session``.
+    status = []
+
+    def start_response(line, headers, exc_info=None):
+        status[:] = [int(line.split()[0]), headers]
+
+    with app.app_context():
+        # db.session is scoped to the app context, which the request reuses.
+        db.session.registry.set(db_session)
+        chunks = app.wsgi_app(env, start_response)
+        try:
+            body = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+    return status[0], status[1], body
+
+
+class AsyncApp:
+    """The ASGI application, see the module docstring."""
+
+    def __init__(self):
+        self.wsgi = WsgiToAsgi(app)
+        # {sync engine: async engine}, created in the serving event loop.
+        self.engines = None
+
+    def connect(self):
+        with app.app_context():
+            self.engines = {
+                engine: create_async_engine(
+                    async_url(engine.url), **engine_options(os.environ)
+                )
+                for engine in db.engines.values()
+            }
+
+    async def dispose(self):
+        if self.engines:
+            for engine in self.engines.values():
+                await engine.dispose()
+        self.engines = None
+
+    def _serves(self, env):
+        if env["REQUEST_METHOD"] not in SAFE_METHODS:
+            return False
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(env).match()
+        except HTTPException:
+            return False
+        return endpoint in app.config["ASYNC_ENDPOINTS"]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http":
+            env = environ(scope)
+            if self._serves(env):
+                return await self._serve(env, receive, send)
+        await self.wsgi(scope, receive, send)
+
+    async def _serve(self, env, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            body.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        env["wsgi.input"] = BytesIO(b"".join(body))
+        env["CONTENT_LENGTH"] = str(len(env["wsgi.input"].getvalue()))
+
+        if self.engines is None:
+            self.connect()
+        async with AsyncSession(
+            sync_session_class=AsyncRoutingSession, engines=self.engines
+        ) as session:
+            status, headers, body = await session.run_sync(_dispatch, env)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in headers
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = AsyncApp()
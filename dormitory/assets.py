@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import abort, request, send_from_directory
+from werkzeug.security import safe_join
+
+from dormitory import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Directory under the static folder that fingerprinted copies are built into.
+app.config.setdefault("ASSETS_DIST", "dist")
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".txt", ".html", ".map"}
+SKIP = {"upload"}
+YEAR = 365 * 24 * 3600
+
+_manifest = None
+
+
+def _dist():
+    return os.path.join(app.static_folder, app.config["ASSETS_DIST"])
+
+
+def manifest():
+    """``{filename: fingerprinted filename}`` of the last build, empty if
+    the assets were never built."""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(_dist(), "manifest.json")) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+
+@app.url_defaults
+def fingerprint(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["filename"] = manifest().get(values["filename"], values["filename"])
+
+
+def static(filename):
+    """Static files, with built assets served precompressed and cached for
+    a year since their names change whenever their content does."""
+    if not filename.startswith(app.config["ASSETS_DIST"] + "/"):
+        return app.send_static_file(filename)
+
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        abort(404)
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_from_directory(
+                app.static_folder,
+                filename + suffix,
+                mimetype=mimetypes.guess_type(filename)[0],
+                max_age=YEAR,
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=YEAR)
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+app.view_functions["static"] = static
+
+
+def _sources():
+    skip = SKIP | {app.config["ASSETS_DIST"]}
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder:
+            dirs[:] = [d for d in dirs if d not in skip]
+        for name in files:
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, app.static_folder).replace(os.sep, "/"), path
+
+
+@app.cli.command()
+@click.option("--clean", is_flag=True, help="Remove earlier builds first.")
+def assets(clean):
+    """Build fingerprinted, precompressed static files."""
+    global _manifest
+    dist = _dist()
+    if clean and os.path.isdir(dist):
+        shutil.rmtree(dist)
+
+    built = {}
+    for filename, path in sorted(_sources()):
+        with open(path, "rb") as f:
+            data = f.read()
+        stem, ext = os.path.splitext(filename)
+        name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        target = os.path.join(dist, *name.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+
+        variants = []
+        if ext.lower() in COMPRESSIBLE:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                variants.append((".gz", compressed))
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data):
+                    variants.append((".br", compressed))
+        for suffix, compressed in variants:
+            with open(target + suffix, "wb") as f:
+                f.write(compressed)
+
+        built[filename] = f"{app.config['ASSETS_DIST']}/{name}"
+        click.echo(
+            f"{filename} -> {built[filename]} {' '.join(s for s, _ in variants)}"
+        )
+
+    with open(os.path.join(dist, "manifest.json"), "w") as f:
+        json.dump(built, f, indent=2, sort_keys=True)
+    _manifest = built
+    click.echo(f"{len(built)} assets built.")
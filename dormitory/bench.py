@@ -0,0 +1,386 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import click
+from sqlalchemy import event
+from sqlalchemy.util import await_only
+
+from dormitory import app, db
+from dormitory.commands import generate
+from dormitory.migrations import create_all
+from dormitory.models import Room, Manager, Student, Fix, Move
+
+SIZES = {
+    "small": dict(dorms=5, students=1000, fixes=2000, visitors=5000, moves=200),
+    "medium": dict(dorms=20, students=5000, fixes=20000, visitors=50000, moves=2000),
+    "large": dict(
+        dorms=100, students=30000, fixes=200000, visitors=500000, moves=20000
+    ),
+}
+
+
+class QueryStats:
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+
+    def before_cursor_execute(self, *args):
+        self.statements += 1
+
+    def do_orm_execute(self, state):
+        if not state.is_select:
+            return None
+        frozen = state.invoke_statement().freeze()
+        self.rows += len(frozen.data)
+        return frozen()
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(db.session, "do_orm_execute", self.do_orm_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(db.session, "do_orm_execute", self.do_orm_execute)
+
+
+def _request(client, method, url, **kwargs):
+    # A fresh app context per request, so ``g`` and the session don't leak
+    # from the CLI context between clients.
+    with app.app_context():
+        return client.open(url, method=method, **kwargs)
+
+
+def _login(username, password, manager=False):
+    client = app.test_client()
+    data = dict(username=username, password=password)
+    if manager:
+        data["manager"] = "y"
+    response = _request(client, "POST", "/login", data=data)
+    if response.status_code != 302 or response.location.endswith("/login"):
+        raise click.ClickException(f"Could not log in as {username}.")
+    return client
+
+
+def _routes():
+    # Explicit order so the picks do not depend on the query plan.
+    manager = Manager.query.filter_by(dorm_id=1).order_by(Manager.id).first()
+    room = Room.query.filter_by(dorm_id=1).order_by(Room.id).first()
+    student = (
+        Student.query.join(Room).filter(Room.dorm_id == 1).order_by(Student.id).first()
+    )
+    fix = Fix.query.join(Room).filter(Room.dorm_id == 1).order_by(Fix.id).first()
+    move = (
+        Move.query.join(Student)
+        .join(Room)
+        .filter(Room.dorm_id == 1)
+        .order_by(Move.id)
+        .first()
+    )
+    db.session.remove()
+
+    anonymous = app.test_client()
+    as_student = _login(student.id, "12345678")
+    as_manager = _login(manager.id, "12345678", manager=True)
+    return {
+        "index": (anonymous, "/"),
+        "dorm_info": (anonymous, "/dorm/1"),
+        "info": (as_student, "/info"),
+        "report": (as_student, "/report"),
+        "visit": (as_student, "/visit"),
+        "manage": (as_manager, "/manage"),
+        "room_info": (as_manager, f"/room/{room.id}"),
+        "fix": (as_manager, "/fix"),
+        "fix_info": (as_manager, f"/fix/{fix.id}"),
+        "move_info": (as_manager, f"/move/{move.id}"),
+        "search": (as_manager, "/search?q=水管"),
+    }
+
+
+def _measure(client, url, repeat):
+    _request(client, "GET", url)
+    timings = []
+    with QueryStats() as stats:
+        for _ in range(repeat):
+            stats.reset()
+            start = time.perf_counter()
+            response = _request(client, "GET", url)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise click.ClickException(
+                    f"GET {url} returned {response.status_code}."
+                )
+    return dict(
+        ms=round(statistics.median(timings), 2),
+        statements=stats.statements,
+        rows=stats.rows,
+    )
+
+
+class Latency:
+    """Sleep before every statement, like a wait on a remote database
+    that holds the worker thread but not the GIL."""
+
+    def __init__(self, ms, engines=None):
+        self.seconds = ms / 1000
+        self.engines = engines
+
+    def before_cursor_execute(self, *args):
+        time.sleep(self.seconds)
+
+    def __enter__(self):
+        if self.engines is None:
+            self.engines = [db.engine]
+        if self.seconds:
+            for engine in self.engines:
+                event.listen(
+                    engine, "before_cursor_execute", self.before_cursor_execute
+                )
+        return self
+
+    def __exit__(self, *exc):
+        if self.seconds:
+            for engine in self.engines:
+                event.remove(
+                    engine, "before_cursor_execute", self.before_cursor_execute
+                )
+
+
+class AsyncLatency(Latency):
+    """The wait awaited on the event loop, which serves other requests
+    meanwhile, for the sync side of async engines."""
+
+    def before_cursor_execute(self, *args):
+        await_only(asyncio.sleep(self.seconds))
+
+
+def _summary(timings, elapsed):
+    # quantiles() needs two timings.
+    p95 = max(timings)
+    if len(timings) > 1:
+        p95 = statistics.quantiles(timings, n=20)[-1]
+    return dict(rps=round(len(timings) / elapsed, 1), p95=round(p95, 2))
+
+
+def _load(client, url, clients, repeat):
+    """Requests per second and 95th percentile latency of ``clients``
+    threads, each with the session of ``client``, sending ``repeat`` GETs."""
+    cookie = client.get_cookie("session")
+
+    def run(_):
+        own = app.test_client()
+        if cookie is not None:
+            own.set_cookie("session", cookie.value)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = _request(own, "GET", url)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise click.ClickException(
+                    f"GET {url} returned {response.status_code}."
+                )
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        timings = [t for ts in pool.map(run, range(clients)) for t in ts]
+    return _summary(timings, time.perf_counter() - start)
+
+
+def _load_async(client, url, clients, repeat, latency):
+    """``_load`` through the ASGI app of ``dormitory.asgi``: ``clients``
+    tasks on one event loop, with ``latency`` ms awaited per statement."""
+    from dormitory.asgi import AsyncApp
+
+    cookie = client.get_cookie("session")
+    path, _, query = url.partition("?")
+    headers = [(b"host", b"localhost")]
+    if cookie is not None:
+        headers.append((b"cookie", f"session={cookie.value}".encode()))
+    scope = dict(
+        type="http",
+        method="GET",
+        path=path,
+        root_path="",
+        query_string=quote(query, safe="=&").encode(),
+        http_version="1.1",
+        headers=headers,
+    )
+
+    async def get(application):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            sent.append(message)
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        if sent[0]["status"] != 200:
+            raise click.ClickException(f"GET {url} returned {sent[0]['status']}.")
+        return (time.perf_counter() - start) * 1000
+
+    async def run(application):
+        return [await get(application) for _ in range(repeat)]
+
+    async def main():
+        application = AsyncApp()
+        application.connect()
+        engines = [engine.sync_engine for engine in application.engines.values()]
+        try:
+            await get(application)
+            with AsyncLatency(latency, engines):
+                start = time.perf_counter()
+                timings = await asyncio.gather(
+                    *(run(application) for _ in range(clients))
+                )
+                elapsed = time.perf_counter() - start
+        finally:
+            await application.dispose()
+        return _summary([t for ts in timings for t in ts], elapsed)
+
+    return asyncio.run(main())
+
+
+@app.cli.command()
+@click.option(
+    "--size",
+    "sizes",
+    multiple=True,
+    type=click.Choice(list(SIZES)),
+    default=["small", "medium"],
+    show_default=True,
+    help="Data sizes to seed and measure.",
+)
+@click.option("--repeat", default=5, show_default=True, help="Requests per route.")
+@click.option(
+    "--budgets",
+    default="benchmarks.json",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Budget file.",
+)
+@click.option("--update", is_flag=True, help="Write the measurements as new budgets.")
+@click.option(
+    "--headroom", default=2.0, show_default=True, help="Latency slack on update."
+)
+@click.option("--force", is_flag=True, help="Allow reseeding a non-SQLite database.")
+@click.option(
+    "--concurrency",
+    default=0,
+    help="Also load every view from this many threads and compare.",
+)
+@click.option(
+    "--latency",
+    default=0.0,
+    help="Milliseconds added to each statement under load, to model a remote database.",
+)
+@click.option(
+    "--asgi",
+    "use_asgi",
+    is_flag=True,
+    help="Also load every view through dormitory.asgi, on an async engine.",
+)
+def bench(
+    sizes, repeat, budgets, update, headroom, force, concurrency, latency, use_asgi
+):
+    """Benchmark every view against seeded data."""
+    if use_asgi:
+        if not concurrency:
+            raise click.ClickException("--asgi needs --concurrency.")
+        try:
+            import dormitory.asgi  # noqa: F401
+        except ImportError as e:
+            raise click.ClickException(f"--asgi needs {e.name}.")
+    if db.engine.url.get_backend_name() != "sqlite" and not force:
+        raise click.ClickException(
+            "bench drops and reseeds the database, pass --force to use "
+            f"{db.engine.url.render_as_string(hide_password=True)}."
+        )
+    try:
+        with open(budgets, encoding="utf-8") as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        stored = {}
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    # Measure the views themselves, not cached copies of their responses.
+    app.config["RESPONSE_CACHE"] = None
+    failures = []
+    for size in sizes:
+        db.drop_all()
+        create_all()
+        generate(**SIZES[size])
+        db.session.remove()
+
+        click.echo(f"\n{size}")
+        click.echo(f"{'route':<12}{'ms':>10}{'statements':>12}{'rows':>8}")
+        routes = _routes()
+        for route, (client, url) in routes.items():
+            result = _measure(client, url, repeat)
+            budget = stored.get(size, {}).get(route)
+            over = [
+                k
+                for k in ("ms", "statements", "rows")
+                if budget and result[k] > budget[k]
+            ]
+            click.echo(
+                f"{route:<12}{result['ms']:>10}{result['statements']:>12}"
+                f"{result['rows']:>8}"
+                + (f"  over budget: {', '.join(over)}" if over else "")
+            )
+            if over and not update:
+                failures.append(f"{size}/{route}")
+            if update:
+                result["ms"] = round(result["ms"] * headroom, 2)
+                stored.setdefault(size, {})[route] = result
+
+        if concurrency:
+            # Printed, and stored on update next to the budgets, but not
+            # budgeted, as throughput depends too much on the machine.
+            click.echo(
+                f"\n{size} under load, {latency} ms per statement\n"
+                f"{'route':<12}{'1 req/s':>10}{f'{concurrency} req/s':>12}"
+                f"{'p95 ms':>10}"
+                + (f"{'async req/s':>14}{'p95 ms':>10}" if use_asgi else "")
+            )
+            load = {}
+            with Latency(latency):
+                for route, (client, url) in routes.items():
+                    single = _load(client, url, 1, repeat * concurrency)
+                    loaded = _load(client, url, concurrency, repeat)
+                    load[route] = dict(sync_rps=loaded["rps"], sync_p95=loaded["p95"])
+                    line = (
+                        f"{route:<12}{single['rps']:>10}{loaded['rps']:>12}"
+                        f"{loaded['p95']:>10}"
+                    )
+                    if use_asgi:
+                        served = _load_async(client, url, concurrency, repeat, latency)
+                        load[route].update(
+                            async_rps=served["rps"], async_p95=served["p95"]
+                        )
+                        line += f"{served['rps']:>14}{served['p95']:>10}"
+                    click.echo(line)
+            if update:
+                stored.setdefault("load", {})[size] = dict(
+                    concurrency=concurrency, latency=latency, routes=load
+                )
+
+    if update:
+        with open(budgets, "w", encoding="utf-8") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+        click.echo(f"\nBudgets written to {budgets}.")
+    elif failures:
+        raise click.ClickException(f"Over budget: {', '.join(failures)}.")
@@ -0,0 +1,264 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from functools import wraps
+
+from flask import make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect
+
+from dormitory import app, db
+from dormitory.counters import subscribe
+from dormitory.models import Dorm, Manager, Room
+from dormitory.routing import use_primary
+from dormitory.utils import LRUCache
+
+# "memory", "filesystem" or None to disable.
+app.config.setdefault("RESPONSE_CACHE", "memory")
+app.config.setdefault("RESPONSE_CACHE_DIR", os.path.join(app.instance_path, "cache"))
+app.config.setdefault("RESPONSE_CACHE_TTL", 300)
+# Entries kept, in memory or in RESPONSE_CACHE_DIR.
+app.config.setdefault("RESPONSE_CACHE_SIZE", 1024)
+# Seconds between sweeps of expired files from RESPONSE_CACHE_DIR.
+app.config.setdefault("RESPONSE_CACHE_SWEEP", 60)
+
+_KEY = "cache_tags"
+
+
+class MemoryBackend:
+    """Entries and tag versions in this process only."""
+
+    def __init__(self, maxsize):
+        self._entries = LRUCache(maxsize)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def set(self, key, value, ttl):
+        self._entries.set(key, (time.time() + ttl, value))
+
+    def version(self, tag):
+        return self._versions.get(tag, 0)
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+
+class FileBackend:
+    """Entries and tag versions as files, shared by every process on the
+    host, so a write in one worker invalidates pages cached by the others.
+
+    An entry's mtime is its expiry. Expired entries are swept every
+    ``interval`` seconds, and the soonest to expire beyond ``maxsize``.
+    """
+
+    def __init__(self, directory, maxsize, interval):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.interval = interval
+        self._swept = time.monotonic()
+        os.makedirs(os.path.join(directory, "tags"), exist_ok=True)
+
+    def _path(self, *parts):
+        name = hashlib.sha256(parts[-1].encode()).hexdigest()
+        return os.path.join(self.directory, *parts[:-1], name)
+
+    def _write(self, path, data, expires=None):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if expires is not None:
+            os.utime(tmp, (expires, expires))
+        os.replace(tmp, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value if expires > time.time() else None
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        self._write(self._path(key), pickle.dumps((expires, value)), expires)
+        if time.monotonic() - self._swept > self.interval:
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired entries, then the soonest to expire while there
+        are more than ``maxsize``, and temporary files left by crashes."""
+        self._swept = time.monotonic()
+        now = time.time()
+        live = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if entry.name.startswith(".tmp"):
+                    if mtime < now - 3600:
+                        _unlink(entry.path)
+                elif mtime <= now:
+                    _unlink(entry.path)
+                else:
+                    live.append((mtime, entry.path))
+        live.sort()
+        for _, path in live[: max(0, len(live) - self.maxsize)]:
+            _unlink(path)
+
+    def version(self, tag):
+        try:
+            with open(self._path("tags", tag), "rb") as f:
+                return f.read().decode()
+        except OSError:
+            return ""
+
+    def bump(self, tag):
+        # A new unique value rather than an increment, so concurrent bumps
+        # from different processes cannot be lost.
+        version = f"{time.time_ns()}-{os.getpid()}"
+        self._write(self._path("tags", tag), version.encode())
+
+
+def _unlink(path):
+    # Another process may have swept it already.
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_backend = None
+
+
+def backend():
+    global _backend
+    kind = app.config["RESPONSE_CACHE"]
+    if not kind:
+        return None
+    if _backend is None:
+        if kind == "filesystem":
+            _backend = FileBackend(
+                app.config["RESPONSE_CACHE_DIR"],
+                app.config["RESPONSE_CACHE_SIZE"],
+                app.config["RESPONSE_CACHE_SWEEP"],
+            )
+        else:
+            _backend = MemoryBackend(app.config["RESPONSE_CACHE_SIZE"])
+    return _backend
+
+
+def invalidate(*tags):
+    store = backend()
+    if store is not None:
+        for tag in tags:
+            store.bump(tag)
+
+
+def invalidate_dorms(dorm_ids):
+    if dorm_ids:
+        invalidate("dorms", *(f"dorm:{dorm_id}" for dorm_id in dorm_ids))
+
+
+def cached(*tags):
+    """Cache the anonymous GET responses of a view under ``tags``, which
+    are formatted with the view arguments, e.g. ``"dorm:{dorm_id}"``.
+
+    Logged in users and responses carrying flashed messages bypass the
+    cache. Hits are revalidated with ``ETag``/``Last-Modified``.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            store = backend()
+            if (
+                store is None
+                or request.method != "GET"
+                or current_user.is_authenticated
+                or "_flashes" in session
+            ):
+                return view(**kwargs)
+
+            names = [tag.format(**kwargs) for tag in tags]
+            key = repr(
+                (
+                    request.endpoint,
+                    sorted(kwargs.items()),
+                    sorted(request.args.items(multi=True)),
+                    [store.version(name) for name in names],
+                )
+            )
+            entry = store.get(key)
+            status = "HIT"
+            if entry is None:
+                # Stored under the current tag versions, so it must not be
+                # rendered from a replica that lags behind the last bump.
+                with use_primary():
+                    response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = (
+                    body,
+                    response.content_type,
+                    hashlib.sha256(body).hexdigest()[:32],
+                    int(time.time()),
+                )
+                store.set(key, entry, app.config["RESPONSE_CACHE_TTL"])
+                status = "MISS"
+
+            body, content_type, etag, modified = entry
+            response = make_response(body)
+            response.content_type = content_type
+            response.set_etag(etag)
+            response.headers["Last-Modified"] = formatdate(modified, usegmt=True)
+            response.cache_control.no_cache = True
+            response.headers["X-Cache"] = status
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
+
+
+@subscribe
+def _occupancy_changed(beds, stale):
+    invalidate_dorms({dorm_id for dorm_id, _ in beds} | set(stale))
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect(session, flush_context):
+    tags = session.info.setdefault(_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Dorm):
+            tags.update(("dorms", f"dorm:{obj.id}"))
+        elif isinstance(obj, (Manager, Room)):
+            # Managers and rooms are only listed on their dorm's page, which
+            # any change to one, a renamed or relevelled room too, alters.
+            dorm_ids = {obj.dorm_id, *inspect(obj).attrs.dorm_id.history.deleted}
+            tags.update(f"dorm:{dorm_id}" for dorm_id in dorm_ids)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate(session):
+    invalidate(*session.info.pop(_KEY, ()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard(session):
+    session.info.pop(_KEY, None)
@@ -1,7 +1,24 @@
 import click
+import csv
+import os
 import random
-from dormitory import app, db
-from dormitory.models import Dorm, Room, Manager, Student, Fix, Visitor
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from dormitory import app, db, hashing
+from dormitory.allocation import POLICIES, allocate
+from dormitory.counters import recount
+from dormitory.migrations import create_all
+from dormitory.models import Dorm, Room, Manager, Student, Fix, Visitor, Move
+from dormitory.search import index, rebuild
+
+STUDENT_FIELDS = ("id", "name", "age", "phone", "major", "grade", "room_id")
+
+# Hash method for forged accounts, which all share a known password.
+app.config.setdefault("FORGE_PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
 
 
 @app.cli.command()
@@ -10,228 +27,358 @@ def initdb(drop):
     """Initialize the database."""
     if drop:
         db.drop_all()
-    db.create_all()
+    create_all()
     click.echo("Database initialized.")
 
 
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘蒋蔡余杜叶程苏魏吕丁沈姚卢钟史毛耿寿常"
+GIVEN_NAMES = "伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚华玉萍红玲燕彬鹏辉晨宇浩然涵欣怡轩萱云雅安慧同文弘坚炎佳滢天"
+MAJORS = [
+    "计算机科学与技术",
+    "软件工程",
+    "理论物理",
+    "化学",
+    "生物",
+    "数学",
+    "电子工程",
+    "自动化",
+    "材料科学",
+    "经济学",
+]
+FIX_CONTENTS = {
+    "电工类": ["灯坏了", "插座没电", "空调不制冷", "电扇不转"],
+    "水工类": ["水管堵塞了", "水龙头漏水", "热水器不出热水", "马桶堵了"],
+    "瓦工类": ["墙皮脱落", "地砖松动", "窗户关不上"],
+    "其他": ["门锁坏了", "床板断了", "网络连不上"],
+}
+VISIT_REASONS = ["探望", "送东西", "学习讨论", "家长来访", "取快递"]
+MOVE_REASONS = ["与室友作息不同", "想和同专业同学住", "宿舍环境嘈杂", "离教学楼更近"]
+EPOCH = datetime(2022, 1, 1)
+
+
+def _name(rng):
+    return rng.choice(SURNAMES) + "".join(
+        rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2))
+    )
+
+
+def _phone(rng):
+    return "1" + rng.choice("3589") + "".join(rng.choices("0123456789", k=9))
+
+
+def _student_id(i):
+    return f"{2018 + i % 4}{i:06d}"
+
+
+def _time(rng, days=730):
+    return EPOCH + timedelta(seconds=rng.randrange(days * 86400))
+
+
+def _insert(model, rows, chunk_size=5000):
+    total = 0
+    for chunk in _batched(rows, chunk_size):
+        db.session.execute(insert(model), chunk)
+        db.session.commit()
+        total += len(chunk)
+    return total
+
+
+def _hashes(password, method, n, chunk_size=5000):
+    """``n`` hashes of ``password``, each with its own salt, generated a
+    chunk at a time as ``_insert`` consumes them."""
+    for start in range(0, n, chunk_size):
+        count = min(chunk_size, n - start)
+        yield from hashing.generate_many([password] * count, method)
+
+
 @app.cli.command()
-def forge():
+@click.option("--dorms", default=10, show_default=True, help="Number of dorms.")
+@click.option("--students", default=60, show_default=True, help="Number of students.")
+@click.option(
+    "--fixes", default=20, show_default=True, help="Number of repair tickets."
+)
+@click.option("--visitors", default=20, show_default=True, help="Number of visits.")
+@click.option("--moves", default=5, show_default=True, help="Number of move requests.")
+@click.option("--seed", default=0, show_default=True, help="Random seed.")
+def forge(dorms, students, fixes, visitors, moves, seed):
     """Generate fake data."""
-    db.create_all()
+    create_all()
+    start = time.perf_counter()
+    counts = generate(dorms, students, fixes, visitors, moves, seed)
+    elapsed = time.perf_counter() - start
+    click.echo(
+        ", ".join(f"{n} {name}" for name, n in counts.items())
+        + f" generated in {elapsed:.1f}s."
+    )
+    click.echo("Done.")
 
-    for i in range(1, 11):
-        levels = random.randint(5, 20)
-        d = Dorm(id=i, levels=levels, gender=random.choice(["男", "女"]))
-        db.session.add(d)
 
-        spaces = random.choice([4, 6])
+def generate(dorms, students, fixes, visitors, moves, seed=0):
+    rng = random.Random(seed)
+    counts = {}
 
+    room_ids = []
+    room_dorms = []
+    dorm_starts = []
+    beds = array("I")
+    dorm_rows = []
+    room_rows = []
+    for i in range(1, dorms + 1):
+        levels = rng.randint(5, 20)
+        spaces = rng.choice([4, 6])
+        dorm_rows.append(dict(id=i, levels=levels, gender=rng.choice(["男", "女"])))
+        dorm_starts.append(len(room_ids))
         for j in range(1, levels + 1):
             for k in range(1, 6):
-                r = Room(id=f"{i}-{j:0>2}0{k}", dorm_id=i, level=j, spaces=spaces)
-                db.session.add(r)
-
-    managers = [
-        {
-            "id": "10234",
-            "name": "史听云",
-            "gender": "女",
-            "age": 30,
-            "phone": "13912345678",
-            "dorm_id": 1,
-        },
-        {
-            "id": "34678",
-            "name": "耿文霞",
-            "gender": "女",
-            "age": 28,
-            "phone": "13012435678",
-            "dorm_id": 2,
-        },
-        {
-            "id": "41301",
-            "name": "毛雅安",
-            "gender": "女",
-            "age": 32,
-            "phone": "13345678901",
-            "dorm_id": 3,
-        },
-        {
-            "id": "48624",
-            "name": "钟同化",
-            "gender": "男",
-            "age": 38,
-            "phone": "13145735678",
-            "dorm_id": 4,
-        },
-        {
-            "id": "55966",
-            "name": "陈弘坚",
-            "gender": "男",
-            "age": 29,
-            "phone": "13245678901",
-            "dorm_id": 5,
-        },
-        {
-            "id": "63289",
-            "name": "邓慧秀",
-            "gender": "女",
-            "age": 31,
-            "phone": "13512345678",
-            "dorm_id": 6,
-        },
-        {
-            "id": "70612",
-            "name": "蒋文彬",
-            "gender": "男",
-            "age": 33,
-            "phone": "13412345678",
-            "dorm_id": 7,
-        },
-        {
-            "id": "77945",
-            "name": "李慧娟",
-            "gender": "女",
-            "age": 35,
-            "phone": "13712345678",
-            "dorm_id": 8,
-        },
-        {
-            "id": "85278",
-            "name": "张同化",
-            "gender": "男",
-            "age": 34,
-            "phone": "13812345678",
-            "dorm_id": 9,
-        },
-        {
-            "id": "92601",
-            "name": "赵文彬",
-            "gender": "男",
-            "age": 36,
-            "phone": "13612345678",
-            "dorm_id": 10,
-        },
-    ]
-
-    for manager in managers:
-        m = Manager(**manager)
-        m.set_password("12345678")
-        db.session.add(m)
-
-    students = [
-        {
-            "id": "20180001",
-            "name": "常阳炎",
-            "age": 20,
-            "phone": "12312312312",
-            "major": "计算机科学与技术",
-            "grade": 2018,
-            "room_id": "2-0501",
-        },
-        {
-            "id": "20180002",
-            "name": "寿丽佳",
-            "age": 19,
-            "phone": "12312312312",
-            "major": "理论物理",
-            "grade": 2018,
-            "room_id": "1-0101",
-        },
-        {
-            "id": "20180003",
-            "name": "李秀静",
-            "age": 20,
-            "phone": "12312312312",
-            "major": "化学",
-            "grade": 2018,
-            "room_id": "1-0301",
-        },
-        {
-            "id": "20180004",
-            "name": "曹滢天",
-            "age": 20,
-            "phone": "12312312312",
-            "major": "生物",
-            "grade": 2018,
-            "room_id": "1-0301",
-        },
-        {
-            "id": "20190001",
-            "name": "杨晨",
-            "age": 18,
-            "phone": "12312312312",
-            "major": "化学",
-            "grade": 2019,
-            "room_id": "3-0405",
-        },
-        {
-            "id": "20190002",
-            "name": "张宇",
-            "age": 19,
-            "phone": "12312312312",
-            "major": "生物",
-            "grade": 2019,
-            "room_id": "4-0202",
-        },
-    ]
-
-    for student in students:
-        s = Student(**student)
-        s.set_password("12345678")
-        db.session.add(s)
-
-    fixes = [
-        {
-            "id": 1,
-            "student_id": "20180002",
-            "room_id": "1-0201",
-            "category": "电工类",
-            "content": "灯坏了",
-            "picture": "/static/upload/灯.jfif",
-            "submit_time": "2021-09-01 12:00:00",
-            "status": "未处理",
-        },
-        {
-            "id": 2,
-            "student_id": "20180003",
-            "room_id": "1-0301",
-            "category": "水工类",
-            "content": "水管堵塞了",
-            "picture": "/static/upload/堵塞.jpg",
-            "submit_time": "2021-10-02 12:00:00",
-            "status": "未处理",
-        },
-    ]
-
-    for fix in fixes:
-        f = Fix(**fix)
-        db.session.add(f)
-
-    visitors = [
-        {
-            "id": 1,
-            "student_id": "20180001",
-            "room_id": "2-0501",
-            "name": "羿茂德",
-            "gender": "男",
-            "phone": "13212331231",
-            "reason": "探望",
-            "visit_time": "2022-01-01 12:00:00",
-            "leave_time": "2022-01-01 14:00:00",
-        }
-    ]
-
-    for visitor in visitors:
-        v = Visitor(**visitor)
-        db.session.add(v)
-
-    for r in Room.query.all():
-        r.residents = len(r.students)
-
-    for d in Dorm.query.all():
-        d.rooms = len(d.apartments)
-        d.left_residents = sum([r.spaces - r.residents for r in d.apartments])
+                room_id = f"{i}-{j:0>2}0{k}"
+                room_rows.append(
+                    dict(id=room_id, dorm_id=i, level=j, spaces=spaces, residents=0)
+                )
+                beds.extend([len(room_ids)] * spaces)
+                room_ids.append(room_id)
+                room_dorms.append(i)
+    dorm_starts.append(len(room_ids))
+    counts["dorms"] = _insert(Dorm, dorm_rows)
+    counts["rooms"] = _insert(Room, room_rows)
+    del dorm_rows, room_rows
+
+    # Hashed one by one so every account has its own salt, but cheaply,
+    # since forged accounts are many; logins upgrade them.
+    method = app.config["FORGE_PASSWORD_HASH_METHOD"]
+    hashes = _hashes("12345678", method, dorms)
+    counts["managers"] = _insert(
+        Manager,
+        (
+            dict(
+                id=str(10000 + i),
+                name=_name(rng),
+                gender=rng.choice(["男", "女"]),
+                age=rng.randint(25, 55),
+                phone=_phone(rng),
+                dorm_id=i,
+                password_hash=next(hashes),
+            )
+            for i in range(1, dorms + 1)
+        ),
+    )
+
+    if students > len(beds):
+        click.echo(f"Only {len(beds)} beds available, capping students.")
+        students = len(beds)
+    rng.shuffle(beds)
+
+    hashes = _hashes("12345678", method, students)
+    counts["students"] = _insert(
+        Student,
+        (
+            dict(
+                id=_student_id(i),
+                name=_name(rng),
+                age=2021 - (2018 + i % 4) + rng.randint(18, 19),
+                phone=_phone(rng),
+                major=rng.choice(MAJORS),
+                grade=2018 + i % 4,
+                room_id=room_ids[beds[i]],
+                password_hash=next(hashes),
+            )
+            for i in range(students)
+        ),
+    )
+
+    if students:
 
+        def fix_row():
+            i = rng.randrange(students)
+            category = rng.choice(list(FIX_CONTENTS))
+            return dict(
+                student_id=_student_id(i),
+                room_id=room_ids[beds[i]],
+                dorm_id=room_dorms[beds[i]],
+                category=category,
+                content=rng.choice(FIX_CONTENTS[category]),
+                submit_time=_time(rng),
+                status=rng.choice(["未处理", "已处理", "已处理"]),
+            )
+
+        def visitor_row():
+            i = rng.randrange(students)
+            visit_time = _time(rng)
+            leave_time = None
+            if rng.random() > 0.05:
+                leave_time = visit_time + timedelta(minutes=rng.randint(10, 360))
+            return dict(
+                student_id=_student_id(i),
+                room_id=room_ids[beds[i]],
+                dorm_id=room_dorms[beds[i]],
+                name=_name(rng),
+                gender=rng.choice(["男", "女"]),
+                phone=_phone(rng),
+                reason=rng.choice(VISIT_REASONS),
+                visit_time=visit_time,
+                leave_time=leave_time,
+            )
+
+        def move_row():
+            i = rng.randrange(students)
+            room = beds[i]
+            first, last = dorm_starts[room_dorms[room] - 1 : room_dorms[room] + 1]
+            target = rng.randrange(first, last - 1)
+            if target >= room:
+                target += 1
+            return dict(
+                student_id=_student_id(i),
+                original_room_id=room_ids[room],
+                target_room_id=room_ids[target],
+                dorm_id=room_dorms[room],
+                reason=rng.choice(MOVE_REASONS),
+                submit_time=_time(rng),
+                status=rng.choice(["未处理", "已拒绝"]),
+            )
+
+        counts["fixes"] = _insert(Fix, (fix_row() for _ in range(fixes)))
+        counts["visitors"] = _insert(Visitor, (visitor_row() for _ in range(visitors)))
+        counts["moves"] = _insert(Move, (move_row() for _ in range(moves)))
+
+    recount()
     db.session.commit()
-    click.echo("Done.")
+    rebuild()
+    return counts
+
+
+def _read_rows(path):
+    if path.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise click.ClickException("Reading XLSX files requires openpyxl.")
+        workbook = load_workbook(path, read_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(h).strip() for h in next(rows, ())]
+        for row in rows:
+            yield dict(zip(header, row))
+        workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@app.cli.command("import-students")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=1000, show_default=True, help="Rows per insert.")
+@click.option("--workers", default=os.cpu_count(), help="Password hashing processes.")
+@click.option("--password", default="12345678", help="Default password.")
+def import_students(path, batch_size, workers, password):
+    """Import students from a CSV or XLSX file."""
+    start = time.perf_counter()
+    imported = skipped = 0
+    free = {}
+    affected = set()
+
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    for batch in _batched(_read_rows(path), batch_size):
+        rows = []
+        seen = set()
+        for row in batch:
+            student = {k: str(row.get(k) or "").strip() for k in STUDENT_FIELDS}
+            student["phone"] = student["phone"] or "12312312312"
+            try:
+                student["age"] = int(student["age"])
+                student["grade"] = int(student["grade"])
+            except ValueError:
+                skipped += 1
+                continue
+            if not all(student.values()) or student["id"] in seen:
+                skipped += 1
+                continue
+            seen.add(student["id"])
+            student["password"] = str(row.get("password") or password)
+            rows.append(student)
+
+        ids = [r["id"] for r in rows]
+        existing = set(
+            db.session.scalars(select(Student.id).where(Student.id.in_(ids)))
+        )
+        unknown = {r["room_id"] for r in rows} - free.keys()
+        if unknown:
+            for room_id, spaces, residents in db.session.execute(
+                select(Room.id, Room.spaces, Room.residents).where(Room.id.in_(unknown))
+            ):
+                free[room_id] = spaces - residents
+
+        accepted = []
+        for r in rows:
+            if r["id"] in existing or free.get(r["room_id"], 0) < 1:
+                skipped += 1
+                continue
+            free[r["room_id"]] -= 1
+            accepted.append(r)
+        if not accepted:
+            continue
+
+        hashes = hashing.generate_many([r.pop("password") for r in accepted])
+        for r, password_hash in zip(accepted, hashes):
+            r["password_hash"] = password_hash
+            affected.add(r["room_id"])
+
+        db.session.execute(insert(Student), accepted)
+        index(db.session, "student", accepted)
+        db.session.commit()
+        imported += len(accepted)
+
+    recount(affected)
+    db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Imported {imported} students, skipped {skipped} "
+        f"in {elapsed:.1f}s ({imported / elapsed:.0f} rows/s)."
+    )
+
+
+@app.cli.command("allocate")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--policy", type=click.Choice(POLICIES), default="floors", show_default=True
+)
+@click.option("--password", default="12345678", help="Default password.")
+def allocate_command(path, policy, password):
+    """Assign rooms to a cohort of students from a CSV or XLSX file."""
+    start = time.perf_counter()
+    cohort = []
+    invalid = 0
+    for row in _read_rows(path):
+        student = {k: str(row.get(k) or "").strip() for k in STUDENT_FIELDS}
+        del student["room_id"]
+        student["phone"] = student["phone"] or "12312312312"
+        student["gender"] = str(row.get("gender") or "").strip()
+        try:
+            student["age"] = int(student["age"])
+            student["grade"] = int(student["grade"])
+            student["dorm_id"] = int(row["dorm_id"]) if row.get("dorm_id") else None
+        except ValueError:
+            invalid += 1
+            continue
+        if not all(v for k, v in student.items() if k != "dorm_id"):
+            invalid += 1
+            continue
+        cohort.append(student)
+
+    placed, unplaced = allocate(cohort, policy, password)
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Placed {len(placed)} students, {len(unplaced)} without a bed, "
+        f"{invalid} invalid rows in {elapsed:.1f}s."
+    )
+    for student in unplaced:
+        click.echo(f"  {student['id']} {student['name']}: no free bed")
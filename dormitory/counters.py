@@ -0,0 +1,228 @@
+from collections import Counter
+
+import click
+from sqlalchemy import bindparam, event, func, inspect, select, update
+
+from dormitory import app, db
+from dormitory.models import Dorm, Room, Student
+
+_KEY = "counter_deltas"
+_COMMITTED = "committed_beds"
+
+# Called after every commit that changed occupancy.
+_subscribers = []
+
+
+def _value(obj, attr, committed=False):
+    history = inspect(obj).attrs[attr].history
+    if committed:
+        if history.deleted:
+            return history.deleted[0]
+        if history.unchanged:
+            return history.unchanged[0]
+        return None
+    return getattr(obj, attr)
+
+
+class Deltas:
+    def __init__(self):
+        self.residents = Counter()
+        self.rooms = Counter()
+        self.left_residents = Counter()
+        # Student moves are recorded by room and resolved to dorms at commit.
+        self.beds = Counter()
+        # Dorms whose rooms were added, removed or edited.
+        self.stale = set()
+
+    def student(self, room_id, delta):
+        if room_id is not None:
+            self.residents[room_id] += delta
+            self.beds[room_id] -= delta
+
+    def room(self, dorm_id, spaces, residents, delta):
+        if dorm_id is not None:
+            self.stale.add(dorm_id)
+            self.rooms[dorm_id] += delta
+            self.left_residents[dorm_id] += delta * ((spaces or 0) - (residents or 0))
+
+
+@event.listens_for(db.session, "after_flush")
+def collect(session, flush_context):
+    deltas = session.info.setdefault(_KEY, Deltas())
+
+    for obj in session.new:
+        if isinstance(obj, Student):
+            deltas.student(obj.room_id, 1)
+        elif isinstance(obj, Room):
+            deltas.room(obj.dorm_id, obj.spaces, obj.residents, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Student):
+            deltas.student(_value(obj, "room_id", committed=True), -1)
+        elif isinstance(obj, Room):
+            deltas.room(
+                _value(obj, "dorm_id", committed=True),
+                _value(obj, "spaces", committed=True),
+                _value(obj, "residents", committed=True),
+                -1,
+            )
+
+    for obj in session.dirty:
+        if not session.is_modified(obj):
+            continue
+        if isinstance(obj, Student):
+            old = _value(obj, "room_id", committed=True)
+            if old != obj.room_id:
+                deltas.student(old, -1)
+                deltas.student(obj.room_id, 1)
+        elif isinstance(obj, Room):
+            old = [_value(obj, a, True) for a in ("dorm_id", "spaces", "residents")]
+            new = [_value(obj, a) for a in ("dorm_id", "spaces", "residents")]
+            # Even when the counts are unchanged, so a renamed room marks
+            # its dorm stale too.
+            deltas.room(*old, -1)
+            deltas.room(*new, 1)
+
+
+@event.listens_for(db.session, "before_commit")
+def apply(session):
+    session.flush()
+    deltas = session.info.pop(_KEY, None)
+    if deltas is None:
+        return
+    connection = session.connection()
+
+    left_residents = deltas.left_residents
+    beds = {k: v for k, v in deltas.beds.items() if v}
+    committed = {}
+    if beds:
+        for room_id, dorm_id in connection.execute(
+            select(Room.id, Room.dorm_id).where(Room.id.in_(beds))
+        ):
+            left_residents[dorm_id] += beds[room_id]
+            committed[dorm_id, room_id] = beds[room_id]
+    session.info[_COMMITTED] = committed, deltas.stale
+
+    rooms = [{"_id": k, "_d": v} for k, v in deltas.residents.items() if v]
+    if rooms:
+        connection.execute(
+            update(Room.__table__)
+            .where(Room.__table__.c.id == bindparam("_id"))
+            .values(residents=Room.__table__.c.residents + bindparam("_d")),
+            rooms,
+        )
+
+    dorm_ids = {k for k, v in deltas.rooms.items() if v}
+    dorm_ids |= {k for k, v in left_residents.items() if v}
+    if dorm_ids:
+        table = Dorm.__table__
+        connection.execute(
+            update(table)
+            .where(table.c.id == bindparam("_id"))
+            .values(
+                rooms=table.c.rooms + bindparam("_rooms"),
+                left_residents=table.c.left_residents + bindparam("_left"),
+            ),
+            [
+                {"_id": k, "_rooms": deltas.rooms[k], "_left": left_residents[k]}
+                for k in dorm_ids
+            ],
+        )
+
+
+def add_residents(session, residents):
+    """Record ``{room_id: n}`` students added with a bulk insert, which
+    bypasses the flush, so they are counted at commit."""
+    deltas = session.info.setdefault(_KEY, Deltas())
+    for room_id, n in residents.items():
+        deltas.student(room_id, n)
+
+
+def move_beds(session, original_room_id, target_room_id):
+    """Record a student moved with a conditional update that already
+    adjusted ``Room.residents``, so only the dorm free beds are left."""
+    deltas = session.info.setdefault(_KEY, Deltas())
+    deltas.beds[original_room_id] += 1
+    deltas.beds[target_room_id] -= 1
+
+
+def subscribe(fn):
+    """Call ``fn(beds, stale)`` after each commit, with the committed
+    ``{(dorm_id, room_id): free bed delta}`` and the dorms whose rooms were
+    added, removed or edited."""
+    _subscribers.append(fn)
+    return fn
+
+
+@event.listens_for(db.session, "after_commit")
+def publish(session):
+    committed = session.info.pop(_COMMITTED, None)
+    if committed is None or not any(committed):
+        return
+    for fn in _subscribers:
+        fn(*committed)
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard(session):
+    session.info.pop(_KEY, None)
+    session.info.pop(_COMMITTED, None)
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def recount(room_ids=None):
+    """Recompute occupancy counters from scratch, for all rooms or only
+    ``room_ids`` and their dorms. Used after bulk inserts that bypass the
+    ORM flush. The dorms are published as stale when the session commits."""
+    residents = (
+        select(func.count(Student.id))
+        .where(Student.room_id == Room.id)
+        .scalar_subquery()
+    )
+    rooms = select(func.count(Room.id)).where(Room.dorm_id == Dorm.id)
+    left_residents = select(
+        func.coalesce(func.sum(Room.spaces - Room.residents), 0)
+    ).where(Room.dorm_id == Dorm.id)
+    dorm_values = dict(
+        rooms=rooms.scalar_subquery(), left_residents=left_residents.scalar_subquery()
+    )
+
+    stale = db.session.info.setdefault(_KEY, Deltas()).stale
+    if room_ids is None:
+        db.session.execute(update(Room).values(residents=residents))
+        db.session.execute(update(Dorm).values(**dorm_values))
+        stale.update(db.session.scalars(select(Dorm.id)))
+        return
+
+    dorm_ids = set()
+    for chunk in _chunks(room_ids):
+        db.session.execute(
+            update(Room)
+            .where(Room.id.in_(chunk))
+            .values(residents=residents)
+            .execution_options(synchronize_session=False)
+        )
+        dorm_ids.update(
+            db.session.scalars(select(Room.dorm_id).where(Room.id.in_(chunk)))
+        )
+    for chunk in _chunks(dorm_ids):
+        db.session.execute(
+            update(Dorm)
+            .where(Dorm.id.in_(chunk))
+            .values(**dorm_values)
+            .execution_options(synchronize_session=False)
+        )
+    stale.update(dorm_ids)
+
+
+@app.cli.command("recount")
+def recount_command():
+    """Recompute room and dorm occupancy counters."""
+    recount()
+    db.session.commit()
+    click.echo("Counters recomputed.")
@@ -1,4 +1,4 @@
-from flask import render_template
+from flask import flash, redirect, render_template, request, url_for
 
 from dormitory import app
 
@@ -13,6 +13,15 @@ def page_not_found(e):
     return render_template("errors/404.html"), 404
 
 
+@app.errorhandler(413)
+def request_entity_too_large(e):
+    # A photo past MAX_CONTENT_LENGTH, before the upload limit was checked.
+    if request.endpoint != "report":
+        return e
+    flash("图片过大，提交失败！", category="danger")
+    return redirect(url_for("report"))
+
+
 @app.errorhandler(500)
 def internal_server_error(e):
     return render_template("errors/500.html"), 500
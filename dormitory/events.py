@@ -0,0 +1,201 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+
+from flask import Response, redirect, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import event, inspect, select
+
+from dormitory import app, db
+from dormitory.counters import subscribe
+from dormitory.models import Room, Student, Fix, Visitor, Move
+
+# Events held for a slow stream before it is told to reload instead.
+app.config.setdefault("EVENTS_BUFFER", 100)
+# Seconds between keep-alive comments on an idle stream.
+app.config.setdefault("EVENTS_KEEPALIVE", 15)
+
+_KEY = "dorm_events"
+
+
+class Broker:
+    """Fans events out to the open streams of each dorm in this process.
+
+    Every stream has its own bounded queue, so publishing never blocks on a
+    slow client; one that falls behind gets a single ``reset`` event.
+    """
+
+    def __init__(self):
+        self._streams = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, dorm_id):
+        stream = queue.Queue(app.config["EVENTS_BUFFER"])
+        with self._lock:
+            self._streams[dorm_id].add(stream)
+        return stream
+
+    def unsubscribe(self, dorm_id, stream):
+        with self._lock:
+            self._streams[dorm_id].discard(stream)
+            if not self._streams[dorm_id]:
+                del self._streams[dorm_id]
+
+    def publish(self, dorm_id, name, data):
+        with self._lock:
+            streams = list(self._streams.get(dorm_id, ()))
+        for stream in streams:
+            try:
+                stream.put_nowait((name, data))
+            except queue.Full:
+                _reset(stream)
+
+
+def _reset(stream):
+    try:
+        while True:
+            stream.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        stream.put_nowait(("reset", {}))
+    except queue.Full:
+        pass
+
+
+broker = Broker()
+
+
+def record(session, dorm_id, name, data):
+    """Publish ``name`` with ``data`` to ``dorm_id`` once ``session``
+    commits, for writes that bypass the flush."""
+    session.info.setdefault(_KEY, []).append((dorm_id, None, name, data))
+
+
+def _room(session, room_id, name, data):
+    # New rows get their dorm_id from the INSERT, so resolve it at commit.
+    session.info.setdefault(_KEY, []).append((None, room_id, name, data))
+
+
+def _changed(obj, attr):
+    return inspect(obj).attrs[attr].history.has_changes()
+
+
+@event.listens_for(db.session, "after_flush")
+def _inserted(session, flush_context):
+    # After the flush, once new rows have their ids.
+    for obj in session.new:
+        if isinstance(obj, Fix):
+            _room(session, obj.room_id, "fix", _fix(obj))
+        elif isinstance(obj, Move):
+            _room(session, obj.original_room_id, "move", _move(obj))
+        elif isinstance(obj, Visitor):
+            _room(session, obj.room_id, "visitor", _visitor(obj, left=False))
+
+
+@event.listens_for(db.session, "before_flush")
+def _updated(session, flush_context, instances):
+    # Before the flush, since attributes set to SQL expressions such as
+    # ``func.now()`` are expired, history and all, once it has run.
+    for obj in session.dirty:
+        if isinstance(obj, Fix) and _changed(obj, "status"):
+            _room(session, obj.room_id, "fix", _fix(obj))
+        elif isinstance(obj, Move) and _changed(obj, "status"):
+            _room(session, obj.original_room_id, "move", _move(obj))
+        elif isinstance(obj, Visitor) and _changed(obj, "leave_time"):
+            _room(session, obj.room_id, "visitor", _visitor(obj, left=True))
+
+
+def _fix(fix):
+    return dict(
+        id=fix.id, room_id=fix.room_id, category=fix.category, status=fix.status
+    )
+
+
+def _move(move):
+    return dict(
+        id=move.id,
+        student_id=move.student_id,
+        original_room_id=move.original_room_id,
+        target_room_id=move.target_room_id,
+        status=move.status,
+    )
+
+
+def _visitor(visitor, left):
+    return dict(id=visitor.id, room_id=visitor.room_id, name=visitor.name, left=left)
+
+
+@event.listens_for(db.session, "before_commit")
+def _resolve(session):
+    session.flush()
+    pending = session.info.get(_KEY)
+    if not pending:
+        return
+    room_ids = {room_id for dorm_id, room_id, _, _ in pending if dorm_id is None}
+    dorms = {}
+    if room_ids:
+        dorms = dict(
+            session.execute(
+                select(Room.id, Room.dorm_id).where(Room.id.in_(room_ids))
+            ).all()
+        )
+    session.info[_KEY] = [
+        (dorm_id if dorm_id is not None else dorms.get(room_id), None, name, data)
+        for dorm_id, room_id, name, data in pending
+    ]
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish(session):
+    for dorm_id, _, name, data in session.info.pop(_KEY, ()):
+        if dorm_id is not None:
+            broker.publish(dorm_id, name, data)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard(session):
+    session.info.pop(_KEY, None)
+
+
+@subscribe
+def _beds(beds, stale):
+    for (dorm_id, room_id), delta in beds.items():
+        broker.publish(dorm_id, "room", dict(id=room_id, free=delta))
+    for dorm_id in stale:
+        broker.publish(dorm_id, "rooms", {})
+
+
+def _format(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/events")
+@login_required
+def events():
+    """Server-sent events of the manager's dorm: new and handled repairs
+    and moves, visitor check-ins and check-outs, and free bed changes."""
+    if current_user.__class__ == Student:
+        return redirect(url_for("index"))
+    dorm_id = current_user.dorm_id
+    keepalive = app.config["EVENTS_KEEPALIVE"]
+    stream = broker.subscribe(dorm_id)
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    name, data = stream.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _format(name, data)
+        finally:
+            broker.unsubscribe(dorm_id, stream)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
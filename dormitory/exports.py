@@ -0,0 +1,168 @@
+import csv
+import io
+import tempfile
+
+import click
+from flask import Response, flash, redirect, stream_with_context, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import select
+
+from dormitory import app, db, tables
+from dormitory.migrations import in_dorm
+from dormitory.models import Room, Student, Fix, Visitor, Move
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# Rows fetched from the server-side cursor at a time.
+app.config.setdefault("EXPORT_BATCH_SIZE", 1000)
+
+CHUNK_SIZE = 64 * 1024
+MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _students(dorm_id):
+    return Student.room_id.in_(select(Room.id).where(Room.dorm_id == dorm_id))
+
+
+# kind: (sheet name, table, filter for a dorm, order served by an index)
+EXPORTS = {
+    "fixes": (
+        "报修",
+        tables.FIXES,
+        lambda dorm_id: in_dorm(Fix, dorm_id),
+        [Fix.submit_time, Fix.id],
+    ),
+    "visitors": (
+        "访客",
+        tables.VISITORS,
+        lambda dorm_id: in_dorm(Visitor, dorm_id),
+        [Visitor.visit_time, Visitor.id],
+    ),
+    "moves": (
+        "转宿",
+        tables.MOVES,
+        lambda dorm_id: in_dorm(Move, dorm_id),
+        [Move.submit_time, Move.id],
+    ),
+    "students": (
+        "学生",
+        tables.ROSTER,
+        _students,
+        [Student.room_id, Student.id],
+    ),
+}
+
+
+def rows(kind, dorm_id):
+    """Stream the rows of ``kind`` in ``dorm_id`` from a server-side cursor,
+    so only one batch is held in memory at a time."""
+    _, table, where, order_by = EXPORTS[kind]
+    stmt = table.select(where(dorm_id)).order_by(*order_by)
+    result = db.session.execute(
+        stmt.execution_options(yield_per=app.config["EXPORT_BATCH_SIZE"])
+    )
+    try:
+        yield from result
+    finally:
+        result.close()
+
+
+# Leading characters that make a spreadsheet read a cell as a formula.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _cell(value):
+    # Text comes from students and visitors, so it must not run as a formula
+    # when a manager opens the file.
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(titles, rows):
+    """Yield ``rows`` under the headings of ``titles`` as UTF-8 CSV chunks,
+    with a BOM for Excel."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(heading for _, heading in titles)
+    for row in rows:
+        writer.writerow(map(_cell, row))
+        if buffer.tell() > CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def write_csv(kind, dorm_id):
+    return csv_chunks(EXPORTS[kind][1].titles, rows(kind, dorm_id))
+
+
+def write_xlsx(kind, dorm_id):
+    """Yield the export as XLSX chunks.
+
+    The write-only workbook spills rows to a temporary file as they are
+    appended, and the finished file is read back in chunks. Unlike CSV
+    nothing is sent until the last row has been written.
+    """
+    sheet, table, _, _ = EXPORTS[kind]
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet)
+    worksheet.append([heading for _, heading in table.titles])
+    for row in rows(kind, dorm_id):
+        worksheet.append([_cell(value) for value in row])
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as f:
+        workbook.save(f)
+        f.seek(0)
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx}
+
+
+@app.route("/export/<kind>.<fmt>")
+@login_required
+def export(kind, fmt):
+    if current_user.__class__ == Student:
+        return redirect(url_for("index"))
+    if kind not in EXPORTS or fmt not in WRITERS:
+        return redirect(url_for("manage"))
+    if fmt == "xlsx" and Workbook is None:
+        flash("暂不支持导出XLSX，请导出CSV！", category="warning")
+        return redirect(url_for("manage"))
+    dorm_id = current_user.dorm_id
+    return Response(
+        stream_with_context(WRITERS[fmt](kind, dorm_id)),
+        mimetype=MIMETYPES[fmt],
+        headers={
+            "Content-Disposition": f"attachment; filename=dorm{dorm_id}-{kind}.{fmt}"
+        },
+    )
+
+
+@app.cli.command("export")
+@click.argument("kind", type=click.Choice(list(EXPORTS)))
+@click.option("--dorm", "dorm_id", type=int, required=True, help="Dorm to export.")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(list(WRITERS)),
+    default="csv",
+    show_default=True,
+)
+@click.option("--output", default="-", help="File to write, - for stdout.")
+def export_command(kind, dorm_id, fmt, output):
+    """Export a dorm's repairs, visitors, moves or students."""
+    if fmt == "xlsx" and Workbook is None:
+        raise click.ClickException("Exporting XLSX requires openpyxl.")
+    with click.open_file(output, "wb") as f:
+        for chunk in WRITERS[fmt](kind, dorm_id):
+            f.write(chunk)
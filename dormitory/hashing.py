@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from dormitory import app
+
+# werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+app.config.setdefault("PASSWORD_HASH_METHOD", "scrypt")
+# Hashing processes per worker, 0 hashes in the calling thread.
+app.config.setdefault("PASSWORD_HASH_WORKERS", os.cpu_count())
+# Hashes allowed in flight before new requests are turned away.
+app.config.setdefault("PASSWORD_HASH_QUEUE", 32)
+app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_pid = None
+
+
+def _executor():
+    global _pool, _slots, _pid
+    with _lock:
+        # A forked server worker must not reuse its parent's pool.
+        if _pool is None or _pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=app.config["PASSWORD_HASH_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _slots = threading.BoundedSemaphore(app.config["PASSWORD_HASH_QUEUE"])
+            _pid = os.getpid()
+        return _pool, _slots
+
+
+def _run(fn, *args):
+    if not app.config["PASSWORD_HASH_WORKERS"]:
+        return fn(*args)
+    pool, slots = _executor()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = pool.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # A hash that outlives the timeout keeps its slot until it finishes,
+    # since a running task cannot be cancelled.
+    future.add_done_callback(lambda f: slots.release())
+    try:
+        return future.result(timeout=app.config["PASSWORD_HASH_TIMEOUT"])
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusy()
+
+
+def generate(password):
+    return _run(generate_password_hash, password, app.config["PASSWORD_HASH_METHOD"])
+
+
+def check(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def generate_many(passwords, method=None):
+    """Hash passwords in bulk, each with a salt of its own.
+
+    Meant for command line imports, so it waits instead of shedding load.
+    ``method`` overrides ``PASSWORD_HASH_METHOD``; such a hash is replaced
+    at the user's next login.
+    """
+    method = method or app.config["PASSWORD_HASH_METHOD"]
+    passwords = list(passwords)
+    methods = [method] * len(passwords)
+    workers = app.config["PASSWORD_HASH_WORKERS"]
+    if workers:
+        pool, _ = _executor()
+        chunksize = max(1, len(passwords) // (workers * 4))
+        hashes = pool.map(
+            generate_password_hash, passwords, methods, chunksize=chunksize
+        )
+    else:
+        hashes = map(generate_password_hash, passwords, methods)
+    return list(hashes)
+
+
+@lru_cache
+def _prefix(method):
+    return generate_password_hash("", method).partition("$")[0]
+
+
+def needs_rehash(password_hash):
+    method = app.config["PASSWORD_HASH_METHOD"]
+    return password_hash.partition("$")[0] != _prefix(method)
@@ -0,0 +1,44 @@
+import time
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from dormitory import app, db
+from dormitory.routing import use_primary
+from dormitory.utils import LRUCache
+
+# Seconds a loaded user may be reused without a query, 0 disables the cache.
+# Entries are dropped on local writes, other processes see them expire.
+app.config.setdefault("USER_CACHE_TTL", 0)
+
+_users = LRUCache(10000)
+
+
+def _snapshot(user):
+    model = type(user)
+    copy = model(
+        **{attr.key: getattr(user, attr.key) for attr in inspect(model).column_attrs}
+    )
+    make_transient_to_detached(copy)
+    return copy
+
+
+def load(model, user_id):
+    ttl = app.config["USER_CACHE_TTL"]
+    key = (model.__name__, user_id)
+    if not ttl:
+        return db.session.get(model, user_id)
+    cached = _users.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return db.session.merge(cached[1], load=False)
+
+    # Cached for every request, so not from a replica that lags behind.
+    with use_primary():
+        user = db.session.get(model, user_id)
+    if user is not None:
+        _users.set(key, (time.monotonic() + ttl, _snapshot(user)))
+    return user
+
+
+def forget(model, user_id):
+    _users.pop((model.__name__, user_id))
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import mysql, sqlite
+
+from dormitory import app, db
+from dormitory.models import Job
+
+app.config.setdefault("JOB_MAX_ATTEMPTS", 5)
+# Seconds before the first retry, doubled after every further failure.
+app.config.setdefault("JOB_RETRY_DELAY", 30)
+# Seconds an idle worker waits before polling again.
+app.config.setdefault("JOB_POLL_INTERVAL", 2)
+# Seconds after which a running job is presumed lost with its worker.
+app.config.setdefault("JOB_TIMEOUT", 600)
+# Days finished jobs are kept, so their keys keep deduplicating.
+app.config.setdefault("JOB_KEEP_DAYS", 7)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+TASKS = {}
+
+
+def task(name):
+    """Register ``fn(*args, **kwargs)`` to run queued jobs named ``name``.
+    Tasks may run more than once, so they must be idempotent."""
+
+    def decorator(fn):
+        TASKS[name] = fn
+        return fn
+
+    return decorator
+
+
+def enqueue(name, *args, key=None, priority=0, delay=0, max_attempts=None, **kwargs):
+    """Queue task ``name`` in the current transaction, so the job exists
+    exactly when the caller's changes commit.
+
+    With a ``key``, the job already queued under it is returned instead,
+    unless it failed, in which case it is queued again with the new
+    arguments. Arguments are stored as JSON.
+    """
+    if name not in TASKS:
+        raise KeyError(name)
+    values = dict(
+        task=name,
+        payload={"args": list(args), "kwargs": kwargs},
+        priority=priority,
+        run_at=datetime.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or app.config["JOB_MAX_ATTEMPTS"],
+    )
+    if key is None:
+        job = Job(**values)
+        db.session.add(job)
+        return job
+    # Not a lookup then an insert: a concurrent request could queue the same
+    # key in between, and the duplicate would fail the caller's commit.
+    db.session.execute(_insert_once(key=key, **values))
+    job = db.session.scalar(
+        select(Job)
+        .filter_by(key=key)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    if job.status == FAILED:
+        for attr, value in values.items():
+            setattr(job, attr, value)
+        job.status = QUEUED
+        job.attempts = 0
+        job.error = job.finished_at = None
+    return job
+
+
+def _insert_once(**values):
+    # A savepoint would do as well, but rolling one back discards what the
+    # session listeners collected for the whole transaction.
+    if db.engine.dialect.name == "mysql":
+        stmt = mysql.insert(Job).values(**values)
+        return stmt.on_duplicate_key_update(key=stmt.inserted.key)
+    return sqlite.insert(Job).values(**values).on_conflict_do_nothing()
+
+
+def claim(worker):
+    """Lock the next due job for ``worker`` and return it, or None.
+
+    The claim is a conditional update, so competing workers never run the
+    same attempt of a job.
+    """
+    now = datetime.now()
+    candidates = db.session.scalars(
+        select(Job.id)
+        .where(Job.status == QUEUED, Job.run_at <= now)
+        .order_by(Job.priority.desc(), Job.run_at, Job.id)
+        .limit(10)
+    ).all()
+    for job_id in candidates:
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == QUEUED)
+            .values(
+                status=RUNNING,
+                locked_by=worker,
+                locked_at=now,
+                attempts=Job.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    db.session.commit()
+    return None
+
+
+def perform(job):
+    """Run a claimed job, then mark it done, or queue it again with an
+    exponential backoff until it runs out of attempts."""
+    try:
+        TASKS[job.task](*job.payload["args"], **job.payload["kwargs"])
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Job %s (%s) failed: %r", job.id, job.task, e)
+        job.error = repr(e)
+        if job.attempts >= job.max_attempts:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            delay = app.config["JOB_RETRY_DELAY"] * 2 ** (job.attempts - 1)
+            job.run_at = datetime.now() + timedelta(seconds=delay)
+    else:
+        job.status = DONE
+        job.error = None
+    if job.status != QUEUED:
+        job.finished_at = datetime.now()
+    job.locked_by = job.locked_at = None
+    db.session.commit()
+
+
+def housekeeping():
+    """Queue jobs whose worker died mid-run again and forget finished
+    jobs past ``JOB_KEEP_DAYS``."""
+    now = datetime.now()
+    lost = db.session.execute(
+        update(Job)
+        .where(
+            Job.status == RUNNING,
+            Job.locked_at < now - timedelta(seconds=app.config["JOB_TIMEOUT"]),
+        )
+        .values(status=QUEUED, locked_by=None, locked_at=None, run_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    purged = db.session.execute(
+        delete(Job)
+        .where(
+            Job.status == DONE,
+            Job.finished_at < now - timedelta(days=app.config["JOB_KEEP_DAYS"]),
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return lost, purged
+
+
+_stopping = False
+
+
+def _stop(signum, frame):
+    global _stopping
+    _stopping = True
+
+
+def work(burst=False):
+    """Run jobs until stopped by SIGTERM or SIGINT, which let the current
+    job finish. With ``burst``, stop once no job is due."""
+    global _stopping
+    _stopping = False
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    interval = app.config["JOB_POLL_INTERVAL"]
+    done = 0
+    last_housekeeping = 0
+    with app.app_context():
+        while not _stopping:
+            if time.monotonic() - last_housekeeping > app.config["JOB_TIMEOUT"]:
+                housekeeping()
+                last_housekeeping = time.monotonic()
+            job = claim(worker)
+            if job is None:
+                if burst:
+                    break
+                time.sleep(interval)
+                continue
+            perform(job)
+            done += 1
+    return done
+
+
+@app.cli.command()
+@click.option("--processes", default=1, show_default=True, help="Worker processes.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+def worker(processes, burst):
+    """Run queued background jobs."""
+    if processes == 1:
+        click.echo(f"{work(burst)} jobs run.")
+        return
+    context = multiprocessing.get_context("spawn")
+    children = [context.Process(target=work, args=(burst,)) for _ in range(processes)]
+    for child in children:
+        child.start()
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+            child.join()
+
+
+@app.cli.command("jobs")
+def jobs_command():
+    """Show queued, running, done and failed job counts."""
+    counts = dict(
+        db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+    )
+    for status in (QUEUED, RUNNING, DONE, FAILED):
+        click.echo(f"{status}: {counts.get(status, 0)}")
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from dormitory import app
+
+app.config.setdefault("METRICS_ENABLED", True)
+app.config.setdefault("SERVER_TIMING", True)
+app.config.setdefault("SLOW_QUERY_MS", 200)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+_lock = threading.Lock()
+_latency = defaultdict(Histogram)
+_db_latency = defaultdict(Histogram)
+_statements = defaultdict(int)
+_responses = defaultdict(int)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    stats = g.get("request_stats") if has_request_context() else None
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.db_time += elapsed
+    if elapsed > stats.slowest:
+        stats.slowest = elapsed
+        stats.slowest_statement = statement
+
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = RequestStats()
+
+
+@app.after_request
+def record_request_stats(response):
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.start
+    endpoint = request.endpoint or "unmatched"
+
+    if app.config["METRICS_ENABLED"]:
+        with _lock:
+            _latency[endpoint].observe(total)
+            _db_latency[endpoint].observe(stats.db_time)
+            _statements[endpoint] += stats.statements
+            _responses[endpoint, response.status_code] += 1
+
+    if stats.slowest * 1000 > app.config["SLOW_QUERY_MS"]:
+        app.logger.warning(
+            "Slow query in %s (%.0f ms): %s",
+            endpoint,
+            stats.slowest * 1000,
+            stats.slowest_statement,
+        )
+
+    if app.config["SERVER_TIMING"]:
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} queries", '
+            f"db-slowest;dur={stats.slowest * 1000:.1f}, "
+            f"app;dur={(total - stats.db_time) * 1000:.1f}, "
+            f"total;dur={total * 1000:.1f}",
+        )
+    return response
+
+
+def _histogram(lines, name, help, histograms):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} histogram")
+    for endpoint, h in sorted(histograms.items()):
+        for bound, count in zip(BUCKETS, h.buckets):
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {h.count}')
+        lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {h.sum:.6f}')
+        lines.append(f'{name}_count{{endpoint="{endpoint}"}} {h.count}')
+
+
+@app.route("/metrics")
+def metrics():
+    if not app.config["METRICS_ENABLED"]:
+        return Response(status=404)
+    lines = []
+    with _lock:
+        _histogram(
+            lines,
+            "dormitory_request_duration_seconds",
+            "Request latency by endpoint.",
+            _latency,
+        )
+        _histogram(
+            lines,
+            "dormitory_request_db_seconds",
+            "Time spent in SQL per request by endpoint.",
+            _db_latency,
+        )
+        lines.append(
+            "# HELP dormitory_db_statements_total SQL statements issued by endpoint."
+        )
+        lines.append("# TYPE dormitory_db_statements_total counter")
+        for endpoint, count in sorted(_statements.items()):
+            lines.append(
+                f'dormitory_db_statements_total{{endpoint="{endpoint}"}} {count}'
+            )
+        lines.append(
+            "# HELP dormitory_responses_total Responses by endpoint and status."
+        )
+        lines.append("# TYPE dormitory_responses_total counter")
+        for (endpoint, status), count in sorted(_responses.items()):
+            lines.append(
+                f'dormitory_responses_total{{endpoint="{endpoint}",status="{status}"}} '
+                f"{count}"
+            )
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,385 @@
+import time
+
+import click
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    String,
+    and_,
+    func,
+    inspect,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import AddConstraint, CreateIndex
+
+from dormitory import app, db
+from dormitory.jobs import DONE, FAILED
+from dormitory.models import Fix, Job, Move, Room, SearchTerm, Student, Visitor
+from dormitory.routing import use_primary
+
+schema_version = db.Table(
+    "schema_version",
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, default=func.now()),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register ``fn(connection)`` as schema version ``version``. Migrations
+    run in version order, each in its own transaction, and must tolerate
+    being run against a schema that already has their changes."""
+
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+
+    return decorator
+
+
+def _index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+
+def create_index(connection, name):
+    """Create the model index ``name`` unless it exists, without blocking
+    writes where the database can build it online."""
+    index = _index(name)
+    existing = inspect(connection).get_indexes(index.table.name)
+    if name in {i["name"] for i in existing}:
+        return False
+    if connection.dialect.name == "mysql":
+        ddl = CreateIndex(index).compile(dialect=connection.dialect)
+        connection.exec_driver_sql(f"{ddl} ALGORITHM=INPLACE LOCK=NONE")
+    else:
+        index.create(connection)
+    return True
+
+
+def add_column(connection, column):
+    """Add the model ``column`` to its table unless it exists, with its
+    foreign keys, so a migrated table matches one from ``create_all()``."""
+    table = column.table.name
+    if column.name in {c["name"] for c in inspect(connection).get_columns(table)}:
+        return False
+    preparer = connection.dialect.identifier_preparer
+    ddl = (
+        f"ALTER TABLE {preparer.quote(table)} ADD COLUMN "
+        f"{preparer.quote(column.name)} {column.type.compile(connection.dialect)}"
+    )
+    if connection.dialect.name != "mysql":
+        # SQLite can only add a foreign key with the column itself. MySQL
+        # parses an inline REFERENCES but ignores it.
+        for fk in column.foreign_keys:
+            ddl += (
+                f" REFERENCES {preparer.quote(fk.column.table.name)}"
+                f" ({preparer.quote(fk.column.name)})"
+            )
+    connection.exec_driver_sql(ddl)
+    add_foreign_keys(connection, column)
+    return True
+
+
+def add_foreign_keys(connection, column):
+    """Add the foreign keys of the model ``column`` that its MySQL table
+    lacks, without checking existing rows, so the table is not copied.
+    Other databases cannot add them to an existing column."""
+    if connection.dialect.name != "mysql":
+        return False
+    existing = {
+        (tuple(fk["constrained_columns"]), fk["referred_table"])
+        for fk in inspect(connection).get_foreign_keys(column.table.name)
+    }
+    added = False
+    for fk in column.foreign_keys:
+        if ((column.name,), fk.column.table.name) in existing:
+            continue
+        ddl = AddConstraint(fk.constraint).compile(dialect=connection.dialect)
+        connection.exec_driver_sql("SET foreign_key_checks = 0")
+        try:
+            connection.exec_driver_sql(f"{ddl}, ALGORITHM=INPLACE, LOCK=NONE")
+        finally:
+            connection.exec_driver_sql("SET foreign_key_checks = 1")
+        added = True
+    return added
+
+
+@migration(1, "Indexes for hot query paths")
+def hot_path_indexes(connection):
+    for name in (
+        "ix_room_dorm_id",
+        "ix_student_room_id",
+        "ix_fix_student_submit",
+        "ix_fix_room_submit",
+        "ix_fix_status",
+        "ix_visitor_student_id",
+        "ix_visitor_visit_time",
+        "ix_visitor_open",
+        "ix_move_student_status",
+        "ix_move_status_submit",
+    ):
+        create_index(connection, name)
+
+
+# Denormalized dorm_id columns and the room column each is derived from.
+DORM_COLUMNS = (
+    (Fix.__table__, "room_id"),
+    (Visitor.__table__, "room_id"),
+    (Move.__table__, "original_room_id"),
+)
+
+
+def backfill_dorm_ids(connection, table, room_column, start=None, stop=None):
+    """Fill ``dorm_id`` of rows lacking it, only ids in [start, stop) if
+    given."""
+    room = Room.__table__
+    stmt = update(table).where(table.c.dorm_id.is_(None))
+    if start is not None:
+        stmt = stmt.where(table.c.id >= start, table.c.id < stop)
+    dorm_id = select(room.c.dorm_id).where(room.c.id == table.c[room_column])
+    return connection.execute(stmt.values(dorm_id=dorm_id.scalar_subquery())).rowcount
+
+
+# Tables known to have no row left without a dorm_id.
+_backfilled = set()
+
+
+def _backfilling(table):
+    if table.name not in _backfilled:
+        pending = select(table.c.id).where(table.c.dorm_id.is_(None)).limit(1)
+        with use_primary():
+            done = db.session.scalar(pending) is None
+        if done:
+            _backfilled.add(table.name)
+    return table.name not in _backfilled
+
+
+def in_dorm(model, dorm_id):
+    """Filter for rows of ``model`` in ``dorm_id``, which also goes through
+    the room for rows ``flask backfill-dorm-ids`` has not reached yet."""
+    table = model.__table__
+    if not _backfilling(table):
+        return model.dorm_id == dorm_id
+    room_column = table.c[dict(DORM_COLUMNS)[table]]
+    rooms = select(Room.id).where(Room.dorm_id == dorm_id)
+    return or_(
+        model.dorm_id == dorm_id,
+        and_(model.dorm_id.is_(None), room_column.in_(rooms)),
+    )
+
+
+def dorm_of(obj):
+    """Dorm of a fix, visit or move, from its room if not backfilled yet."""
+    if obj.dorm_id is not None:
+        return obj.dorm_id
+    room_id = getattr(obj, dict(DORM_COLUMNS)[obj.__table__])
+    return db.session.scalar(select(Room.dorm_id).where(Room.id == room_id))
+
+
+@migration(2, "Denormalized dorm_id on fix, visitor and move")
+def dorm_ids(connection):
+    # Existing rows are left to `flask backfill-dorm-ids`, which commits in
+    # chunks instead of locking whole tables for one long UPDATE.
+    for table, _ in DORM_COLUMNS:
+        add_column(connection, table.c.dorm_id)
+    for name in ("ix_fix_dorm_submit", "ix_visitor_dorm_visit", "ix_move_dorm_submit"):
+        create_index(connection, name)
+
+
+@migration(3, "Background job queue")
+def job_queue(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+
+@migration(4, "Search index")
+def search_index(connection):
+    # Filled by `flask reindex`, which can run while the app serves.
+    SearchTerm.__table__.create(connection, checkfirst=True)
+
+
+@migration(5, "Job finish time")
+def job_finished_at(connection):
+    add_column(connection, Job.__table__.c.finished_at)
+
+
+@migration(6, "Foreign keys of dorm_id")
+def dorm_id_foreign_keys(connection):
+    # For MySQL schemas migrated to version 2 before add_column() added
+    # foreign keys. SQLite ones keep dorm_id without one, as SQLite can only
+    # add it by rebuilding the table.
+    for table, _ in DORM_COLUMNS:
+        add_foreign_keys(connection, table.c.dorm_id)
+
+
+@migration(7, "Finish time of jobs finished before version 5")
+def job_finished_at_backfill(connection):
+    # Housekeeping purges by finish time, which older jobs lack. Their last
+    # run_at is when they last ran, so they expire as if finished then.
+    job = Job.__table__
+    connection.execute(
+        update(job)
+        .where(job.c.status.in_((DONE, FAILED)), job.c.finished_at.is_(None))
+        .values(finished_at=job.c.run_at)
+    )
+
+
+def current_version(connection):
+    if not inspect(connection).has_table(schema_version.name):
+        schema_version.create(connection)
+    return connection.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def stamp(connection, version=None):
+    """Record migrations up to ``version``, all by default, as applied
+    without running them, for a schema created by ``create_all()``."""
+    applied = current_version(connection)
+    rows = [
+        {"version": v, "name": name}
+        for v, name, _ in MIGRATIONS
+        if applied < v and (version is None or v <= version)
+    ]
+    if rows:
+        connection.execute(schema_version.insert(), rows)
+
+
+def create_all():
+    """Create missing tables, stamping a fresh database with the latest
+    version since ``create_all()`` already builds the current schema."""
+    with db.engine.connect() as connection:
+        fresh = not inspect(connection).get_table_names()
+    db.create_all()
+    if fresh:
+        with db.engine.begin() as connection:
+            stamp(connection)
+
+
+def _hot_queries():
+    yield "room by dorm", select(Room.id).where(Room.dorm_id == 1).order_by(Room.id)
+    yield "students in room", select(Student.id).where(Student.room_id == "1-0101")
+    yield "student fixes", select(Fix.id).where(Fix.student_id == "0").order_by(
+        Fix.submit_time, Fix.id
+    )
+    yield "dorm fixes", select(Fix.id).where(Fix.dorm_id == 1).order_by(
+        Fix.submit_time, Fix.id
+    )
+    yield "open fixes", select(Fix.id).where(Fix.status == "未处理").order_by(
+        Fix.submit_time
+    )
+    yield "student visitors", select(Visitor.id).where(
+        Visitor.student_id == "0"
+    ).order_by(Visitor.id)
+    yield "open visitors", select(Visitor.id).where(
+        Visitor.student_id == "0", Visitor.leave_time.is_(None)
+    )
+    yield "student moves", select(Move.id).where(
+        Move.student_id == "0", Move.status == "未处理"
+    )
+    yield "dorm moves", select(Move.id).where(Move.dorm_id == 1).order_by(
+        Move.submit_time, Move.id
+    )
+    yield "pending moves", select(Move.id).where(Move.status == "未处理").order_by(
+        Move.submit_time, Move.id
+    )
+
+
+def query_plan(connection, stmt):
+    """Query plan of ``stmt`` as one line per plan row."""
+    sql = stmt.compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+        return [row.detail for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {sql}").mappings()
+    if connection.dialect.name == "mysql":
+        return [
+            f"{r['table']}: {r['type']} key={r['key']} rows={r['rows']} {r['Extra'] or ''}"
+            for r in rows
+        ]
+    return [" ".join(str(v) for v in r.values()) for r in rows]
+
+
+def _plans(connection):
+    plans = {}
+    for name, stmt in _hot_queries():
+        try:
+            plans[name] = query_plan(connection, stmt)
+        except DBAPIError as e:
+            # Queries on columns a pending migration adds.
+            connection.rollback()
+            plans[name] = [f"unavailable ({e.orig})"]
+    return plans
+
+
+@app.cli.command()
+@click.option("--to", "target", type=int, help="Stop at this schema version.")
+@click.option("--explain/--no-explain", default=True, help="Report query plans.")
+@click.option("--stamp", "stamp_only", is_flag=True, help="Record without running.")
+def migrate(target, explain, stamp_only):
+    """Apply pending schema migrations."""
+    with db.engine.connect() as connection:
+        applied = current_version(connection)
+        connection.commit()
+        pending = [
+            m
+            for m in MIGRATIONS
+            if m[0] > applied and (target is None or m[0] <= target)
+        ]
+        if not pending:
+            click.echo(f"Schema is up to date at version {applied}.")
+            return
+        if stamp_only:
+            stamp(connection, pending[-1][0])
+            connection.commit()
+            click.echo(f"Stamped schema version {pending[-1][0]}.")
+            return
+
+        before = _plans(connection) if explain else {}
+        connection.commit()
+        for version, name, fn in pending:
+            start = time.perf_counter()
+            with connection.begin():
+                fn(connection)
+                connection.execute(
+                    schema_version.insert(), {"version": version, "name": name}
+                )
+            click.echo(
+                f"Applied {version}: {name} in {time.perf_counter() - start:.1f}s."
+            )
+        if not explain:
+            return
+        after = _plans(connection)
+        connection.commit()
+        for query, plan in after.items():
+            click.echo(f"\n{query}")
+            for line in before[query]:
+                click.echo(f"  before: {line}")
+            for line in plan:
+                click.echo(f"  after:  {line}")
+
+
+@app.cli.command("backfill-dorm-ids")
+@click.option("--chunk-size", default=10000, show_default=True, help="Rows per commit.")
+def backfill_dorm_ids_command(chunk_size):
+    """Fill dorm_id on fix, visitor and move rows that lack it."""
+    with db.engine.connect() as connection:
+        for table, room_column in DORM_COLUMNS:
+            last = connection.scalar(select(func.max(table.c.id))) or 0
+            total = 0
+            for start in range(0, last + 1, chunk_size):
+                total += backfill_dorm_ids(
+                    connection, table, room_column, start, start + chunk_size
+                )
+                connection.commit()
+            click.echo(f"{table.name}: {total} rows backfilled.")
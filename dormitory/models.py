@@ -1,7 +1,8 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, select
+from sqlalchemy.dialects import mysql
 
-from dormitory import db
+from dormitory import db, hashing
 
 
 class Dorm(db.Model):
@@ -13,6 +14,8 @@ class Dorm(db.Model):
 
 
 class Room(db.Model):
+    __table_args__ = (db.Index("ix_room_dorm_id", "dorm_id", "id"),)
+
     id = db.Column(db.String(20), primary_key=True)
     dorm_id = db.Column(db.Integer, db.ForeignKey("dorm.id"), nullable=False)
     dorm = db.relationship("Dorm", backref=db.backref("apartments"))
@@ -33,13 +36,18 @@ class Manager(db.Model, UserMixin):
     password_hash = db.Column(db.String(256))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashing.generate(password)
 
     def validate_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hashing.check(self.password_hash, password)
+
+    def get_id(self):
+        return f"manager:{self.id}"
 
 
 class Student(db.Model, UserMixin):
+    __table_args__ = (db.Index("ix_student_room_id", "room_id"),)
+
     id = db.Column(db.String(20), primary_key=True)
     name = db.Column(db.String(20), nullable=False)
     age = db.Column(db.Integer, nullable=False)
@@ -52,18 +60,29 @@ class Student(db.Model, UserMixin):
     password_hash = db.Column(db.String(256))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashing.generate(password)
 
     def validate_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hashing.check(self.password_hash, password)
+
+    def get_id(self):
+        return f"student:{self.id}"
 
 
 class Fix(db.Model):
+    __table_args__ = (
+        db.Index("ix_fix_student_submit", "student_id", "submit_time", "id"),
+        db.Index("ix_fix_room_submit", "room_id", "submit_time", "id"),
+        db.Index("ix_fix_status", "status", "submit_time"),
+        db.Index("ix_fix_dorm_submit", "dorm_id", "submit_time", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.String(20), db.ForeignKey("student.id"), nullable=False)
     student = db.relationship("Student", backref=db.backref("fixes"))
     room_id = db.Column(db.String(20), db.ForeignKey("room.id"), nullable=False)
     room = db.relationship("Room", backref=db.backref("fixes"))
+    dorm_id = db.Column(db.Integer, db.ForeignKey("dorm.id"))
     category = db.Column(db.String(20), nullable=False)
     content = db.Column(db.String(100))
     picture = db.Column(db.String(100))
@@ -72,10 +91,25 @@ class Fix(db.Model):
 
 
 class Visitor(db.Model):
+    __table_args__ = (
+        db.Index("ix_visitor_student_id", "student_id", "id"),
+        db.Index("ix_visitor_visit_time", "visit_time"),
+        db.Index("ix_visitor_dorm_visit", "dorm_id", "visit_time"),
+        # Partial where supported, a plain composite index on MySQL.
+        db.Index(
+            "ix_visitor_open",
+            "student_id",
+            "leave_time",
+            sqlite_where=db.text("leave_time IS NULL"),
+            postgresql_where=db.text("leave_time IS NULL"),
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.String(20), db.ForeignKey("student.id"), nullable=False)
     student = db.relationship("Student", backref=db.backref("visitors"))
     room_id = db.Column(db.String(20), nullable=False)
+    dorm_id = db.Column(db.Integer, db.ForeignKey("dorm.id"))
     name = db.Column(db.String(20), nullable=False)
     gender = db.Column(db.String(10), nullable=False)
     phone = db.Column(db.String(20), nullable=False)
@@ -85,11 +119,76 @@ class Visitor(db.Model):
 
 
 class Move(db.Model):
+    __table_args__ = (
+        db.Index("ix_move_student_status", "student_id", "status"),
+        db.Index("ix_move_status_submit", "status", "submit_time", "id"),
+        db.Index("ix_move_dorm_submit", "dorm_id", "submit_time", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.String(20), db.ForeignKey("student.id"), nullable=False)
     student = db.relationship("Student", backref=db.backref("moves"))
     original_room_id = db.Column(db.String(20), nullable=False)
     target_room_id = db.Column(db.String(20), nullable=False)
+    dorm_id = db.Column(db.Integer, db.ForeignKey("dorm.id"))
     reason = db.Column(db.String(100))
     submit_time = db.Column(db.DateTime, default=db.func.now())
     status = db.Column(db.String(20), default="未处理")
+
+
+class Job(db.Model):
+    __table_args__ = (db.Index("ix_job_due", "status", "priority", "run_at", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    # Jobs with the same key are only queued once, unless the job failed.
+    key = db.Column(db.String(200), unique=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    # Higher runs first.
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+
+
+# A 1- or 2-character gram of an indexed document and how often it occurs.
+class SearchTerm(db.Model):
+    __tablename__ = "search_term"
+    __table_args__ = (
+        db.Index("ix_search_term_dorm", "dorm_id", "kind", "term", "doc_id", "count"),
+    )
+
+    # Led by doc_id, so that searches, which group by it, use the index
+    # above rather than scan a whole kind in key order.
+    doc_id = db.Column(db.String(20), primary_key=True)
+    kind = db.Column(db.String(10), primary_key=True)
+    # Binary collation, so case or accent variants are distinct terms.
+    term = db.Column(
+        db.String(2).with_variant(mysql.VARCHAR(2, collation="utf8mb4_bin"), "mysql"),
+        primary_key=True,
+    )
+    dorm_id = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=1)
+
+
+def _dorm_of(room_column):
+    def set_dorm_id(mapper, connection, target):
+        # Filled in by the INSERT itself, so no extra round trip.
+        if target.dorm_id is None:
+            target.dorm_id = (
+                select(Room.dorm_id)
+                .where(Room.id == getattr(target, room_column))
+                .scalar_subquery()
+            )
+
+    return set_dorm_id
+
+
+event.listen(Fix, "before_insert", _dorm_of("room_id"))
+event.listen(Visitor, "before_insert", _dorm_of("room_id"))
+event.listen(Move, "before_insert", _dorm_of("original_room_id"))
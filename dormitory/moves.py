@@ -0,0 +1,143 @@
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+from dormitory import app, db
+from dormitory.counters import move_beds
+from dormitory.events import record
+from dormitory.identity import forget
+from dormitory.migrations import in_dorm
+from dormitory.models import Move, Room, Student
+
+# Times a batch is retried after a deadlock or lock wait timeout.
+app.config.setdefault("MOVE_RETRIES", 3)
+
+PENDING = "未处理"
+APPROVED = "已同意"
+REJECTED = "已拒绝"
+
+_room = Room.__table__
+_move = Move.__table__
+_student = Student.__table__
+
+
+def pending(dorm_id, move_ids=None):
+    """Pending moves of students in ``dorm_id``, optionally only
+    those in ``move_ids``, oldest first."""
+    stmt = (
+        select(Move.id, Move.student_id, Move.original_room_id, Move.target_room_id)
+        .where(in_dorm(Move, dorm_id), Move.status == PENDING)
+        .order_by(Move.submit_time, Move.id)
+    )
+    if move_ids is not None:
+        stmt = stmt.where(Move.id.in_(move_ids))
+    return db.session.execute(stmt).all()
+
+
+def _record(move, dorm_id, status):
+    record(
+        db.session,
+        dorm_id,
+        "move",
+        dict(
+            id=move.id,
+            student_id=move.student_id,
+            original_room_id=move.original_room_id,
+            target_room_id=move.target_room_id,
+            status=status,
+        ),
+    )
+
+
+def _book(connection, room_id, delta):
+    stmt = update(_room).where(_room.c.id == room_id)
+    if delta > 0:
+        stmt = stmt.where(_room.c.residents + delta <= _room.c.spaces)
+    return connection.execute(stmt.values(residents=_room.c.residents + delta)).rowcount
+
+
+def _approve(move):
+    """Apply one move. Every step is a conditional update, so concurrent
+    approvals can neither overbook the target room nor approve the same
+    request twice; a step that loses a race undoes the earlier ones while
+    their row locks are still held."""
+    connection = db.session.connection()
+    if not _book(connection, move.target_room_id, 1):
+        return False
+    claimed = connection.execute(
+        update(_move)
+        .where(_move.c.id == move.id, _move.c.status == PENDING)
+        .values(status=APPROVED)
+    ).rowcount
+    if not claimed:
+        _book(connection, move.target_room_id, -1)
+        return None
+    moved = connection.execute(
+        update(_student)
+        .where(
+            _student.c.id == move.student_id,
+            _student.c.room_id == move.original_room_id,
+        )
+        .values(room_id=move.target_room_id)
+    ).rowcount
+    if not moved:
+        # The student left the original room since applying.
+        _book(connection, move.target_room_id, -1)
+        connection.execute(
+            update(_move).where(_move.c.id == move.id).values(status=PENDING)
+        )
+        return None
+    _book(connection, move.original_room_id, -1)
+    move_beds(db.session, move.original_room_id, move.target_room_id)
+    return True
+
+
+def approve(move_ids, dorm_id):
+    """Approve pending moves in one transaction, oldest first.
+
+    Returns the ids approved, the ids whose target room was full and the
+    ids that were already handled by someone else.
+    """
+    for attempt in range(app.config["MOVE_RETRIES"] + 1):
+        approved, full = [], []
+        moves = pending(dorm_id, move_ids)
+        try:
+            for move in moves:
+                result = _approve(move)
+                if result:
+                    approved.append(move.id)
+                    _record(move, dorm_id, APPROVED)
+                elif result is False:
+                    full.append(move.id)
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            if attempt == app.config["MOVE_RETRIES"]:
+                raise
+            continue
+        break
+
+    for move in moves:
+        if move.id in approved:
+            forget(Student, move.student_id)
+    done = set(approved) | set(full)
+    handled = [i for i in move_ids if i not in done]
+    return approved, full, handled
+
+
+def reject(move_ids, dorm_id):
+    """Reject pending moves in one transaction and return the ids rejected.
+    Each is a conditional update, so a move approved or rejected by someone
+    else since it was read is neither recorded nor returned."""
+    rejected = []
+    connection = db.session.connection()
+    for move in pending(dorm_id, move_ids):
+        changed = connection.execute(
+            update(_move)
+            .where(_move.c.id == move.id, _move.c.status == PENDING)
+            .values(status=REJECTED)
+        ).rowcount
+        if changed:
+            rejected.append(move.id)
+            _record(move, dorm_id, REJECTED)
+    db.session.commit()
+    return rejected
@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import json
+import time
+from datetime import datetime
+from functools import cached_property
+
+from flask import request
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import and_, func, or_, select
+
+from dormitory import app, db
+from dormitory.routing import use_primary
+from dormitory.utils import LRUCache
+
+app.config.setdefault("PAGINATION_COUNT", True)
+app.config.setdefault("PAGINATION_COUNT_TTL", 30)
+
+
+# (expires, total), keyed by query.
+_counts = LRUCache(1024)
+
+# Query argument carrying the last sort key of the page being shown.
+ANCHOR_ARG = "after"
+
+
+def _after(order_by, key):
+    # Both MySQL and SQLite sort NULLs first, so past a NULL key come the
+    # other NULLs with greater later keys and then every non-NULL value.
+    def equal(column, value):
+        return column.is_(None) if value is None else column == value
+
+    clauses = []
+    for i, column in enumerate(order_by):
+        greater = column.is_not(None) if key[i] is None else column > key[i]
+        clauses.append(and_(*map(equal, order_by[:i], key[:i]), greater))
+    return or_(*clauses)
+
+
+class KeysetPagination(Pagination):
+    """Page through a ``select()`` by seeking past the last sort key of the
+    previous page instead of using ``OFFSET``.
+
+    Page numbers stay in the URL, so ``render_pagination`` works unchanged
+    given ``args=pagination.args``, which adds the sort key reached at the
+    end of this page. The next page seeks past exactly the rows the reader
+    saw, however the table changed meanwhile; any other page, or a link
+    from another list, falls back to ``OFFSET``.
+    """
+
+    @cached_property
+    def _cache_key(self):
+        stmt = self._query_args["select"]
+        params = stmt.compile().params
+        return str(stmt), tuple(sorted(params.items(), key=lambda i: i[0]))
+
+    @cached_property
+    def _digest(self):
+        key = repr((self._cache_key, self.per_page)).encode()
+        return hashlib.sha1(key).hexdigest()[:8]
+
+    def _encode(self, page, key):
+        values = json.dumps(key, default=datetime.isoformat, separators=(",", ":"))
+        payload = base64.urlsafe_b64encode(values.encode()).decode().rstrip("=")
+        return f"{page}.{self._digest}.{payload}"
+
+    def _decode(self, token):
+        try:
+            page, digest, payload = token.split(".")
+            if int(page) != self.page or digest != self._digest:
+                return None
+            key = json.loads(
+                base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            )
+            order_by = self._query_args["order_by"]
+            if not isinstance(key, list) or len(key) != len(order_by):
+                return None
+            return [
+                (
+                    datetime.fromisoformat(v)
+                    if v is not None and c.type.python_type is datetime
+                    else v
+                )
+                for c, v in zip(order_by, key)
+            ]
+        except (ValueError, TypeError, NotImplementedError):
+            return None
+
+    def _query_items(self):
+        stmt = self._query_args["select"]
+        order_by = self._query_args["order_by"]
+        columns = stmt.column_descriptions
+        scalar = len(columns) == 1 and columns[0]["type"] is columns[0].get("entity")
+
+        keys = [c.label(f"_key{i}") for i, c in enumerate(order_by)]
+        query = stmt.add_columns(*keys).order_by(*order_by)
+        anchor = None
+        if self.page > 1 and self._query_args.get("after"):
+            anchor = self._decode(self._query_args["after"])
+        if anchor is not None:
+            query = query.where(_after(order_by, anchor))
+        elif self.page > 1:
+            query = query.offset(self._query_offset)
+        rows = db.session.execute(query.limit(self.per_page + 1)).all()
+
+        self._has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        self.args = {}
+        if rows:
+            key = list(rows[-1][-len(order_by) :])
+            self.args[ANCHOR_ARG] = self._encode(self.page + 1, key)
+        if scalar:
+            return [row[0] for row in rows]
+        return [dict(zip(row._fields, row[: len(columns)])) for row in rows]
+
+    def _query_count(self):
+        ttl = app.config["PAGINATION_COUNT_TTL"]
+        key = self._cache_key
+        cached = _counts.get(key)
+        if ttl and cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        stmt = self._query_args["select"].order_by(None).subquery()
+        with use_primary():
+            total = db.session.scalar(select(func.count()).select_from(stmt))
+        _counts.set(key, (time.monotonic() + ttl, total))
+        return total
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return self.page + self._has_more
+        return super().pages
+
+    @property
+    def has_next(self):
+        return self._has_more
+
+
+def paginate(stmt, order_by, page, per_page=5):
+    """Paginate ``stmt`` in ascending ``order_by`` order, which must end
+    with a unique column."""
+    return KeysetPagination(
+        page=page,
+        per_page=per_page,
+        count=app.config["PAGINATION_COUNT"],
+        select=stmt,
+        order_by=order_by,
+        after=request.args.get(ANCHOR_ARG),
+    )
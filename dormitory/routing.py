@@ -0,0 +1,91 @@
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA = "replica"
+SAFE_METHODS = {"GET", "HEAD"}
+_STICKY = "_primary_until"
+
+
+def engine_options(environ):
+    """Pool settings from ``DATABASE_POOL_SIZE``, ``DATABASE_MAX_OVERFLOW``,
+    ``DATABASE_POOL_RECYCLE`` and ``DATABASE_POOL_PRE_PING``, where set."""
+    options = {}
+    for name, option in (
+        ("DATABASE_POOL_SIZE", "pool_size"),
+        ("DATABASE_MAX_OVERFLOW", "max_overflow"),
+        ("DATABASE_POOL_RECYCLE", "pool_recycle"),
+    ):
+        if environ.get(name):
+            options[option] = int(environ[name])
+    if environ.get("DATABASE_POOL_PRE_PING"):
+        options["pool_pre_ping"] = environ["DATABASE_POOL_PRE_PING"].lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+    return options
+
+
+def replica_binds(environ):
+    """Binds ``replica0``, ``replica1``, ... for the comma separated URLs in
+    ``DATABASE_REPLICA_URLS``."""
+    urls = [u.strip() for u in environ.get("DATABASE_REPLICA_URLS", "").split(",")]
+    return {f"{REPLICA}{i}": url for i, url in enumerate(u for u in urls if u)}
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block. For loads that fill caches
+    shared across requests, which must not keep a lagging replica's rows
+    for their whole lifetime."""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get("primary")
+    g.primary = True
+    try:
+        yield
+    finally:
+        g.primary = previous
+
+
+class RoutingSession(Session):
+    """Sends the reads of GET and HEAD requests to a replica, picked once
+    per request, and everything else to the primary.
+
+    A request that commits makes the client read from the primary for the
+    next ``REPLICA_STICKY_SECONDS``, so it sees its own writes before the
+    replicas catch up.
+    """
+
+    def replicas(self):
+        return [key for key in self._db.engines if key and key.startswith(REPLICA)]
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reading(clause):
+            replicas = self.replicas()
+            if replicas:
+                if "replica_bind" not in g:
+                    g.replica_bind = random.choice(replicas)
+                return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reading(self, clause):
+        if not has_request_context() or request.method not in SAFE_METHODS:
+            return False
+        if self._flushing or isinstance(clause, UpdateBase):
+            return False
+        return not g.get("primary") and session.get(_STICKY, 0) < time.time()
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _stick(db_session):
+    if has_request_context() and db_session.replicas():
+        g.primary = True
+        session[_STICKY] = time.time() + current_app.config["REPLICA_STICKY_SECONDS"]
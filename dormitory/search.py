@@ -0,0 +1,245 @@
+import re
+import time
+from collections import Counter, defaultdict
+
+import click
+from flask import redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import delete, desc, event, func, inspect, insert, select
+
+from dormitory import app, db, tables
+from dormitory.models import Room, Student, Fix, Visitor, SearchTerm
+
+# Hits shown per kind of document.
+app.config.setdefault("SEARCH_LIMIT", 20)
+
+# kind: (model, indexed columns)
+KINDS = {
+    "student": (Student, ("name", "major")),
+    "fix": (Fix, ("category", "content")),
+    "visitor": (Visitor, ("name", "reason")),
+}
+_KINDS = {model: kind for kind, (model, _) in KINDS.items()}
+_KEY = "search_docs"
+WORD = re.compile(r"\w+")
+
+
+def grams(texts):
+    """Count the characters and character pairs of every word in ``texts``,
+    which covers both Chinese text and short ASCII tokens."""
+    counts = Counter()
+    for text in texts:
+        for word in WORD.findall((text or "").lower()):
+            counts.update(word)
+            counts.update(word[i : i + 2] for i in range(len(word) - 1))
+    return counts
+
+
+def query_grams(q):
+    """Terms a document must contain to match ``q``: the pairs of each
+    word, or the word itself if it is a single character."""
+    terms = set()
+    for word in WORD.findall(q.lower()):
+        if len(word) == 1:
+            terms.add(word)
+        terms.update(word[i : i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def index(session, kind, rows):
+    """Index ``rows`` of ``kind``, dicts with ``id``, ``room_id`` and the
+    indexed columns, when ``session`` commits. For bulk inserts, which
+    bypass the flush."""
+    docs = session.info.setdefault(_KEY, {})
+    for row in rows:
+        texts = [row[column] for column in KINDS[kind][1]]
+        docs[kind, str(row["id"])] = (row["room_id"], texts)
+
+
+def unindex(session, kind, ids):
+    """Drop documents of ``kind`` from the index when ``session`` commits.
+    For bulk deletes, which bypass the flush."""
+    docs = session.info.setdefault(_KEY, {})
+    for doc_id in ids:
+        docs[kind, str(doc_id)] = None
+
+
+def _changed(obj, columns):
+    state = inspect(obj)
+    return any(state.attrs[c].history.has_changes() for c in columns)
+
+
+def _document(obj, kind):
+    return obj.room_id, [getattr(obj, column) for column in KINDS[kind][1]]
+
+
+@event.listens_for(db.session, "after_flush")
+def _inserted(session, flush_context):
+    # After the flush, once new rows have their ids.
+    docs = session.info.setdefault(_KEY, {})
+    for obj in session.new:
+        kind = _KINDS.get(type(obj))
+        if kind is not None:
+            docs[kind, str(obj.id)] = _document(obj, kind)
+
+
+@event.listens_for(db.session, "before_flush")
+def _updated(session, flush_context, instances):
+    docs = session.info.setdefault(_KEY, {})
+    for obj in session.dirty:
+        kind = _KINDS.get(type(obj))
+        if kind is not None and _changed(obj, (*KINDS[kind][1], "room_id")):
+            docs[kind, str(obj.id)] = _document(obj, kind)
+    for obj in session.deleted:
+        kind = _KINDS.get(type(obj))
+        if kind is not None:
+            docs[kind, str(obj.id)] = None
+
+
+def _replace(session, docs):
+    """Rewrite the terms of ``{(kind, doc_id): (dorm_id, texts) or None}``."""
+    by_kind = defaultdict(list)
+    for kind, doc_id in docs:
+        by_kind[kind].append(doc_id)
+    for kind, ids in by_kind.items():
+        for i in range(0, len(ids), 500):
+            session.execute(
+                delete(SearchTerm).where(
+                    SearchTerm.kind == kind, SearchTerm.doc_id.in_(ids[i : i + 500])
+                )
+            )
+    rows = [
+        dict(kind=kind, doc_id=doc_id, term=term, dorm_id=doc[0], count=count)
+        for (kind, doc_id), doc in docs.items()
+        if doc is not None and doc[0] is not None
+        for term, count in grams(doc[1]).items()
+    ]
+    if rows:
+        session.execute(insert(SearchTerm.__table__), rows)
+
+
+@event.listens_for(db.session, "before_commit")
+def _update(session):
+    session.flush()
+    docs = session.info.pop(_KEY, None)
+    if not docs:
+        return
+    room_ids = {doc[0] for doc in docs.values() if doc is not None}
+    dorms = {}
+    if room_ids:
+        dorms = dict(
+            session.execute(
+                select(Room.id, Room.dorm_id).where(Room.id.in_(room_ids))
+            ).all()
+        )
+    _replace(
+        session,
+        {
+            key: None if doc is None else (dorms.get(doc[0]), doc[1])
+            for key, doc in docs.items()
+        },
+    )
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard(session):
+    session.info.pop(_KEY, None)
+
+
+def search(dorm_id, q, limit=None):
+    """``{kind: [(doc_id, score)]}`` of the documents in ``dorm_id`` that
+    contain every term of ``q``, best first. The score is how often the
+    terms occur in the document."""
+    terms = query_grams(q)
+    limit = limit or app.config["SEARCH_LIMIT"]
+    hits = {}
+    if not terms:
+        return hits
+    for kind in KINDS:
+        hits[kind] = db.session.execute(
+            select(SearchTerm.doc_id, func.sum(SearchTerm.count).label("score"))
+            .where(
+                SearchTerm.dorm_id == dorm_id,
+                SearchTerm.kind == kind,
+                SearchTerm.term.in_(terms),
+            )
+            .group_by(SearchTerm.doc_id)
+            .having(func.count() == len(terms))
+            .order_by(desc("score"), SearchTerm.doc_id.desc())
+            .limit(limit)
+        ).all()
+    return hits
+
+
+# kind: (heading, table, id column)
+RESULTS = {
+    "student": ("学生", tables.ROSTER, Student.id),
+    "fix": ("维修申请", tables.FIXES, Fix.id),
+    "visitor": ("访客", tables.VISITORS, Visitor.id),
+}
+
+
+@app.route("/search")
+@login_required
+def search_view():
+    if current_user.__class__ == Student:
+        return redirect(url_for("index"))
+    q = request.args.get("q", "").strip()
+    results = []
+    for kind, hits in search(current_user.dorm_id, q).items():
+        heading, table, id_column = RESULTS[kind]
+        ids = [id_column.type.python_type(doc_id) for doc_id, _ in hits]
+        rows = {}
+        if ids:
+            rows = {row["id"]: row for row in table.rows(id_column.in_(ids))}
+        results.append(
+            (kind, heading, table.titles, [rows[i] for i in ids if i in rows])
+        )
+    return render_template("search.html", q=q, results=results)
+
+
+def rebuild(kinds=None, chunk_size=2000, clean=False):
+    """Index every document of ``kinds``, all by default, a chunk per
+    transaction so the app keeps serving, and return how many were
+    indexed per kind. With ``clean``, stale terms are removed first."""
+    counts = {}
+    for kind in kinds or KINDS:
+        model, columns = KINDS[kind]
+        if clean:
+            db.session.execute(delete(SearchTerm).where(SearchTerm.kind == kind))
+            db.session.commit()
+        stmt = (
+            select(model.id, Room.dorm_id, *(getattr(model, c) for c in columns))
+            .join(Room, Room.id == model.room_id)
+            .order_by(model.id)
+            .limit(chunk_size)
+        )
+        counts[kind] = 0
+        last = None
+        while True:
+            chunk = stmt if last is None else stmt.where(model.id > last)
+            rows = db.session.execute(chunk).all()
+            if not rows:
+                break
+            _replace(
+                db.session, {(kind, str(row[0])): (row[1], row[2:]) for row in rows}
+            )
+            db.session.commit()
+            last = rows[-1][0]
+            counts[kind] += len(rows)
+    return counts
+
+
+@app.cli.command()
+@click.option("--kind", "kinds", multiple=True, type=click.Choice(list(KINDS)))
+@click.option("--chunk-size", default=2000, show_default=True, help="Rows per commit.")
+@click.option("--clean", is_flag=True, help="Empty the index of each kind first.")
+def reindex(kinds, chunk_size, clean):
+    """Rebuild the search index."""
+    start = time.perf_counter()
+    counts = rebuild(kinds, chunk_size, clean)
+    elapsed = time.perf_counter() - start
+    click.echo(
+        ", ".join(f"{n} {kind}" for kind, n in counts.items())
+        + f" documents indexed in {elapsed:.1f}s."
+    )
@@ -0,0 +1,46 @@
+// Live updates for managers, pushed by /events as they are committed.
+(function () {
+    var feed = document.getElementById("events");
+    if (!feed || !window.EventSource) {
+        return;
+    }
+    var source = new EventSource(feed.dataset.url);
+    var left = document.getElementById("left-residents");
+
+    function show(text) {
+        var item = document.createElement("li");
+        item.textContent = new Date().toLocaleTimeString() + " " + text;
+        feed.prepend(item);
+        while (feed.children.length > 20) {
+            feed.lastElementChild.remove();
+        }
+    }
+
+    function on(name, describe) {
+        source.addEventListener(name, function (e) {
+            show(describe(JSON.parse(e.data)));
+        });
+    }
+
+    on("fix", function (d) {
+        return d.room_id + " 维修申请#" + d.id + "（" + d.category + "）" + d.status;
+    });
+    on("move", function (d) {
+        return "转宿申请#" + d.id + " " + d.student_id + " " + d.original_room_id + " → " + d.target_room_id + " " + d.status;
+    });
+    on("visitor", function (d) {
+        return d.room_id + " 访客" + d.name + (d.left ? "已离开" : "已登记");
+    });
+    on("room", function (d) {
+        if (left) {
+            left.textContent = Number(left.textContent) + d.free;
+        }
+        return d.id + " 空余床位" + (d.free > 0 ? "+" : "") + d.free;
+    });
+    on("rooms", function () {
+        return "房间信息有变动，请刷新页面。";
+    });
+    on("reset", function () {
+        return "部分更新未能显示，请刷新页面。";
+    });
+})();
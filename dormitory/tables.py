@@ -0,0 +1,141 @@
+from sqlalchemy import select
+
+from dormitory import db
+from dormitory.models import Dorm, Room, Manager, Student, Fix, Visitor, Move
+
+
+class Table:
+    """Columns of ``model`` shown by ``render_table``, declared once as the
+    ``(attribute, heading)`` titles the macro takes.
+
+    Rows are read with column-only selects into plain dicts, so listings
+    skip ORM hydration and the identity map, and never load columns such as
+    ``password_hash`` that they do not show.
+    """
+
+    def __init__(self, model, *titles):
+        self.model = model
+        self.titles = list(titles)
+
+    def select(self, *where, **filters):
+        columns = [getattr(self.model, name) for name, _ in self.titles]
+        return select(*columns).where(*where).filter_by(**filters)
+
+    def rows(self, *where, order_by=(), **filters):
+        stmt = self.select(*where, **filters).order_by(*order_by)
+        return [row._asdict() for row in db.session.execute(stmt)]
+
+
+DORMS = Table(
+    Dorm,
+    ("id", "#"),
+    ("levels", "楼层数"),
+    ("rooms", "总房间数"),
+    ("left_residents", "空余床位数"),
+    ("gender", "性别"),
+)
+
+MANAGERS = Table(
+    Manager,
+    ("id", "工号"),
+    ("name", "姓名"),
+    ("gender", "性别"),
+    ("age", "年龄"),
+    ("phone", "电话"),
+)
+
+ROOMS = Table(
+    Room,
+    ("id", "房间号"),
+    ("level", "楼层"),
+    ("spaces", "床位数"),
+    ("residents", "入住人数"),
+)
+
+STUDENTS = Table(
+    Student,
+    ("id", "学号"),
+    ("name", "姓名"),
+    ("age", "年龄"),
+    ("phone", "电话"),
+    ("major", "专业"),
+    ("grade", "年级"),
+)
+
+# Dorm-wide rosters and visitor logs, as exported for managers.
+ROSTER = Table(
+    Student,
+    ("id", "学号"),
+    ("name", "姓名"),
+    ("room_id", "房间号"),
+    ("age", "年龄"),
+    ("phone", "电话"),
+    ("major", "专业"),
+    ("grade", "年级"),
+)
+
+VISITORS = Table(
+    Visitor,
+    ("id", "访客编号"),
+    ("student_id", "学号"),
+    ("name", "访客姓名"),
+    ("room_id", "房间号"),
+    ("gender", "性别"),
+    ("phone", "电话"),
+    ("reason", "来访原因"),
+    ("visit_time", "访问时间"),
+    ("leave_time", "离开时间"),
+)
+
+# A student's own repairs, visitors and moves leave out the student.
+MY_FIXES = Table(
+    Fix,
+    ("id", "报修编号"),
+    ("room_id", "房间号"),
+    ("category", "类别"),
+    ("content", "内容"),
+    ("submit_time", "提交时间"),
+    ("status", "状态"),
+)
+
+FIXES = Table(
+    Fix,
+    ("id", "报修编号"),
+    ("student_id", "学号"),
+    ("room_id", "房间号"),
+    ("category", "类别"),
+    ("content", "内容"),
+    ("submit_time", "提交时间"),
+    ("status", "状态"),
+)
+
+MY_VISITORS = Table(
+    Visitor,
+    ("id", "访客编号"),
+    ("name", "访客姓名"),
+    ("room_id", "房间号"),
+    ("gender", "性别"),
+    ("phone", "电话"),
+    ("visit_time", "访问时间"),
+    ("leave_time", "离开时间"),
+)
+
+MY_MOVES = Table(
+    Move,
+    ("id", "申请编号"),
+    ("original_room_id", "原房间号"),
+    ("target_room_id", "目标房间号"),
+    ("reason", "原因"),
+    ("status", "状态"),
+)
+
+MOVES = Table(
+    Move,
+    ("id", "申请编号"),
+    ("student_id", "学号"),
+    ("original_room_id", "原房间号"),
+    ("target_room_id", "目标房间号"),
+    ("reason", "原因"),
+    ("submit_time", "提交时间"),
+    ("status", "状态"),
+)
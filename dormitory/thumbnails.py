@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from sqlalchemy import select
+
+from dormitory import app, db
+from dormitory.jobs import enqueue, task
+from dormitory.models import Fix
+from dormitory.uploads import store, strip
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Widths to render, the largest doubles as the EXIF-free full view.
+app.config.setdefault("THUMBNAIL_SIZES", (300, 600, 1600))
+# Resizing processes used by `flask thumbnails`, 0 resizes in-process.
+app.config.setdefault("THUMBNAIL_WORKERS", 1)
+
+# Variants keep the original format, except GIFs become still PNGs.
+FORMATS = {".jpg": "JPEG", ".png": "PNG", ".webp": "WEBP", ".gif": "PNG"}
+
+_lock = threading.Lock()
+_pool = None
+_pid = None
+
+
+def _executor():
+    global _pool, _pid
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=app.config["THUMBNAIL_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pid = os.getpid()
+        return _pool
+
+
+def variant(key, width):
+    """Key of the ``width`` pixel wide rendition of upload ``key``."""
+    stem, ext = os.path.splitext(key)
+    return f"{stem}_{width}{'.png' if ext == '.gif' else ext}"
+
+
+def render(path, targets):
+    """Write each ``(width, path)`` in ``targets`` as a resized, EXIF-free
+    copy of the image at ``path``. Runs in the worker processes."""
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for width, target in targets:
+            ext = os.path.splitext(target)[1]
+            copy = image.copy()
+            if copy.width > width:
+                copy.thumbnail((width, copy.height * width // copy.width + 1))
+            if FORMATS[ext] == "JPEG" and copy.mode != "RGB":
+                copy = copy.convert("RGB")
+            tmp = f"{target}.part"
+            # Image.save() only writes EXIF when asked to.
+            copy.save(tmp, FORMATS[ext], quality=85, optimize=True)
+            os.replace(tmp, target)
+
+
+def _missing(key):
+    return [
+        (width, store.path(variant(key, width)))
+        for width in app.config["THUMBNAIL_SIZES"]
+        if not store.exists(variant(key, width))
+    ]
+
+
+@task("thumbnails")
+def render_missing(key):
+    targets = _missing(key)
+    if targets:
+        render(store.path(key), targets)
+
+
+def submit(key):
+    """Queue thumbnails for upload ``key`` with the current transaction,
+    to be rendered by ``flask worker``."""
+    if Image is None or not key or key.startswith("/"):
+        return None
+    return enqueue("thumbnails", key, key=f"thumbnails:{key}")
+
+
+@app.template_global()
+def thumbnail_url(key, width):
+    """URL of the smallest variant at least ``width`` pixels wide, or of
+    the original until it has been rendered."""
+    if key.startswith("/"):
+        return key
+    for size in sorted(app.config["THUMBNAIL_SIZES"]):
+        if size >= width:
+            if store.exists(variant(key, size)):
+                return store.url(variant(key, size))
+            break
+    return store.url(key)
+
+
+@app.cli.command()
+def thumbnails():
+    """Render missing thumbnails of repair photos and strip the EXIF data
+    of photos stored before uploads were stripped."""
+    if Image is None:
+        raise click.ClickException("Rendering thumbnails requires Pillow.")
+    keys = db.session.scalars(
+        select(Fix.picture).where(Fix.picture.is_not(None)).distinct()
+    )
+    keys = [k for k in keys if not k.startswith("/") and store.exists(k)]
+    stripped = sum(strip(store.path(k)) for k in keys)
+    jobs = [(store.path(k), _missing(k)) for k in keys]
+    jobs = [(path, targets) for path, targets in jobs if targets]
+    if jobs and app.config["THUMBNAIL_WORKERS"]:
+        for _ in _executor().map(render, *zip(*jobs)):
+            pass
+    else:
+        for path, targets in jobs:
+            render(path, targets)
+    click.echo(
+        f"Thumbnails rendered for {len(jobs)} pictures, "
+        f"EXIF data stripped from {stripped}."
+    )
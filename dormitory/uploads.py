@@ -0,0 +1,183 @@
+import abc
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import request, url_for
+
+from dormitory import app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+app.config.setdefault("UPLOAD_FOLDER", os.path.join(app.root_path, "static", "upload"))
+app.config.setdefault("UPLOAD_MAX_BYTES", 10 * 1024 * 1024)
+app.config.setdefault("UPLOAD_EXTENSIONS", (".jpg", ".jpeg", ".png", ".gif", ".webp"))
+# Stop reading request bodies far beyond any allowed upload.
+app.config.setdefault("MAX_CONTENT_LENGTH", 2 * app.config["UPLOAD_MAX_BYTES"])
+
+CHUNK_SIZE = 64 * 1024
+# Stored files and their renditions, which never change once written.
+IMMUTABLE = re.compile(r"upload/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_\d+)?\.\w+")
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UnsupportedType(UploadError):
+    pass
+
+
+def extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".jpeg":
+        ext = ".jpg"
+    return ext
+
+
+def strip(path):
+    """Rewrite the image at ``path`` without its EXIF data, which may hold
+    the camera and location, turned upright as the EXIF said. Returns
+    whether the file changed. Needs Pillow, without it files are kept."""
+    if Image is None:
+        return False
+    tmp = f"{path}.exif"
+    try:
+        with Image.open(path) as image:
+            if not image.getexif():
+                return False
+            fmt = image.format
+            # Image.save() only writes EXIF when asked to.
+            if getattr(image, "is_animated", False):
+                image.save(tmp, fmt, save_all=True)
+            else:
+                ImageOps.exif_transpose(image).save(tmp, fmt, quality=95)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Not an image Pillow can rewrite, so no EXIF it could strip.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest
+
+
+class UploadStore(abc.ABC):
+    """Content-addressed file storage.
+
+    Files are keyed ``ab/cd/<sha256><ext>``, so identical uploads are stored
+    once and names never collide. Keys are what gets saved on the models.
+    """
+
+    @abc.abstractmethod
+    def save(self, stream, filename):
+        """Store the file read from ``stream`` and return its key."""
+
+    @abc.abstractmethod
+    def open(self, key):
+        pass
+
+    @abc.abstractmethod
+    def exists(self, key):
+        pass
+
+    @abc.abstractmethod
+    def url(self, key):
+        pass
+
+    @staticmethod
+    def key(digest, ext):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+class LocalStore(UploadStore):
+    """Stores uploads under ``UPLOAD_FOLDER``, served as static files, so
+    images are stripped of their EXIF data before they are stored."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def save(self, stream, filename):
+        ext = extension(filename)
+        if ext not in app.config["UPLOAD_EXTENSIONS"]:
+            raise UnsupportedType(ext)
+        limit = app.config["UPLOAD_MAX_BYTES"]
+        digest = hashlib.sha256()
+        size = 0
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := stream.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > limit:
+                        raise UploadTooLarge(size)
+                    digest.update(chunk)
+                    f.write(chunk)
+            if strip(tmp):
+                digest = _digest(tmp)
+            key = self.key(digest.hexdigest(), ext)
+            path = self.path(key)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return key
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def url(self, key):
+        return url_for("static", filename=f"upload/{key}")
+
+
+store = LocalStore(app.config["UPLOAD_FOLDER"])
+
+
+@app.template_global()
+def upload_url(key):
+    # Pictures saved before the store are absolute /static/upload/ paths.
+    if key.startswith("/"):
+        return key
+    return store.url(key)
+
+
+@app.after_request
+def cache_uploads(response):
+    if (
+        request.endpoint == "static"
+        and response.status_code in (200, 304)
+        and IMMUTABLE.fullmatch(request.view_args.get("filename", ""))
+    ):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
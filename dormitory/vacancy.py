@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from dormitory import app, db
+from dormitory.counters import subscribe
+from dormitory.models import Room
+from dormitory.routing import use_primary
+from dormitory.utils import LRUCache
+
+# Seconds a dorm's free rooms are served from memory, 0 disables the index.
+# Local writes update it at commit, other processes see them on expiry.
+app.config.setdefault("FREE_ROOMS_TTL", 60)
+
+# (expires, {room_id: free beds}) of the rooms with a free bed, in id order,
+# keyed by dorm.
+_dorms = LRUCache(1024)
+# Serializes the read-modify-write of ``update`` across committing threads.
+_lock = threading.Lock()
+
+
+def _load(dorm_id):
+    ttl = app.config["FREE_ROOMS_TTL"]
+    cached = _dorms.get(dorm_id)
+    if ttl and cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    with use_primary():
+        free = dict(
+            db.session.execute(
+                select(Room.id, Room.spaces - Room.residents)
+                .where(Room.dorm_id == dorm_id, Room.spaces > Room.residents)
+                .order_by(Room.id)
+            ).all()
+        )
+    if ttl:
+        _dorms.set(dorm_id, (time.monotonic() + ttl, free))
+    return free
+
+
+def rooms(dorm_id):
+    """Ids of the rooms in ``dorm_id`` with a free bed, in id order."""
+    return list(_load(dorm_id))
+
+
+@subscribe
+def update(beds, stale=()):
+    """Apply committed ``{(dorm_id, room_id): delta}`` free bed changes and
+    drop the dorms in ``stale``, whose rooms were added, removed or edited."""
+    changes = defaultdict(dict)
+    for (dorm_id, room_id), delta in beds.items():
+        changes[dorm_id][room_id] = delta
+    with _lock:
+        for dorm_id in stale:
+            _dorms.pop(dorm_id)
+        for dorm_id, deltas in changes.items():
+            cached = _dorms.get(dorm_id)
+            if cached is None:
+                continue
+            free = dict(cached[1])
+            for room_id, delta in deltas.items():
+                n = free.get(room_id, 0) + delta
+                if n > 0:
+                    free[room_id] = n
+                else:
+                    free.pop(room_id, None)
+            _dorms.set(dorm_id, (cached[0], dict(sorted(free.items()))))
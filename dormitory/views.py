@@ -1,7 +1,9 @@
-import os
-
-from dormitory import app, db
+from dormitory import app, db, hashing, moves, tables, thumbnails, uploads, vacancy
+from dormitory.cache import cached
+from dormitory.identity import forget
+from dormitory.migrations import dorm_of, in_dorm
 from dormitory.models import Dorm, Room, Manager, Student, Fix, Visitor, Move
+from dormitory.pagination import paginate
 
 from flask import render_template, request, url_for, redirect, flash
 from flask_wtf import FlaskForm, CSRFProtect
@@ -12,6 +14,7 @@ from wtforms import (
     BooleanField,
     SubmitField,
     SelectField,
+    SelectMultipleField,
     FileField,
     TextAreaField,
     DateTimeLocalField,
@@ -24,73 +27,33 @@ csrf = CSRFProtect(app)
 @app.route("/index.html", methods=["GET", "POST"])
 @app.route("/index", methods=["GET", "POST"])
 @app.route("/", methods=["GET", "POST"])
+@cached("dorms")
 def index():
     page = request.args.get("page", 1, type=int)
-    pagination = Dorm.query.paginate(page=page, per_page=5)
-    dorms = pagination.items
-
-    titles = [
-        ("id", "#"),
-        ("levels", "楼层数"),
-        ("rooms", "总房间数"),
-        ("left_residents", "空余床位数"),
-        ("gender", "性别"),
-    ]
+    pagination = paginate(tables.DORMS.select(), [Dorm.id], page)
 
     return render_template(
         "index.html",
         pagination=pagination,
-        dorms=dorms,
-        titles=titles,
+        dorms=pagination.items,
+        titles=tables.DORMS.titles,
     )
 
 
 @app.route("/dorm/<int:dorm_id>")
+@cached("dorm:{dorm_id}")
 def dorm_info(dorm_id):
     dorm = Dorm.query.get_or_404(dorm_id)
-    managers = []
-    for manager in dorm.managers:
-        managers.append(
-            {
-                "id": manager.id,
-                "name": manager.name,
-                "gender": manager.gender,
-                "age": manager.age,
-                "phone": manager.phone,
-            }
-        )
-    title = [
-        ("id", "工号"),
-        ("name", "姓名"),
-        ("gender", "性别"),
-        ("age", "年龄"),
-        ("phone", "电话"),
-    ]
+    managers = tables.MANAGERS.rows(dorm_id=dorm_id, order_by=[Manager.id])
     page = request.args.get("page", 1, type=int)
-    pagination = Room.query.filter_by(dorm_id=dorm_id).paginate(page=page, per_page=5)
-    rooms = []
-    for room in pagination.items:
-        rooms.append(
-            {
-                "id": room.id,
-                "level": room.level,
-                "spaces": room.spaces,
-                "residents": room.residents,
-            }
-        )
-    room_title = [
-        ("id", "房间号"),
-        ("level", "楼层"),
-        ("spaces", "床位数"),
-        ("residents", "入住人数"),
-    ]
+    pagination = paginate(tables.ROOMS.select(dorm_id=dorm_id), [Room.id], page)
     return render_template(
         "dorm.html",
         dorm=dorm.id,
         managers=managers,
-        title=title,
-        rooms=rooms,
-        room_title=room_title,
+        title=tables.MANAGERS.titles,
+        rooms=pagination.items,
+        room_title=tables.ROOMS.titles,
         pagination=pagination,
     )
 
@@ -115,9 +78,17 @@ def login():
         else:
             user = Student.query.filter_by(id=username).first()
 
-        if user is None or not user.validate_password(password):
-            flash("用户名或密码错误!", category="danger")
-            return redirect(url_for("login"))
+        try:
+            if user is None or not user.validate_password(password):
+                flash("用户名或密码错误!", category="danger")
+                return redirect(url_for("login"))
+            if hashing.needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
+        except hashing.HashingBusy:
+            db.session.rollback()
+            flash("登录人数过多，请稍后再试!", category="warning")
+            return render_template("login.html", form=form), 503
 
         login_user(user)
         flash(f"登录成功!", category="success")
@@ -152,6 +123,7 @@ def settings():
             if form.password.data:
                 current_user.set_password(form.password.data)
             db.session.commit()
+            forget(current_user.__class__, current_user.id)
             flash(f"设置已保存！", category="success")
         except:
             db.session.rollback()
@@ -173,44 +145,10 @@ def info():
     if current_user.__class__ == Manager:
         return redirect(url_for("index"))
     room = Room.query.get(current_user.room_id)
-    students = []
-    for student in room.students:
-        students.append(
-            {
-                "id": student.id,
-                "name": student.name,
-                "age": student.age,
-                "phone": student.phone,
-                "major": student.major,
-                "grade": student.grade,
-            }
-        )
-    title = [
-        ("id", "学号"),
-        ("name", "姓名"),
-        ("age", "年龄"),
-        ("phone", "电话"),
-        ("major", "专业"),
-        ("grade", "年级"),
-    ]
-
     move = Move.query.filter_by(student_id=current_user.id)
-    move_title = [
-        ("id", "申请编号"),
-        ("original_room_id", "原房间号"),
-        ("target_room_id", "目标房间号"),
-        ("reason", "原因"),
-        ("status", "状态"),
-    ]
 
-    available_rooms = (
-        Room.query.filter_by(dorm_id=room.dorm_id)
-        .filter(Room.id != room.id)
-        .filter(Room.spaces - Room.residents > 0)
-        .all()
-    )
     form = MoveForm()
-    form.room.choices = [(r.id, r.id) for r in available_rooms]
+    form.room.choices = [(r, r) for r in vacancy.rooms(room.dorm_id) if r != room.id]
 
     if form.validate_on_submit():
         if move.filter_by(status="未处理").first():
@@ -234,11 +172,11 @@ def info():
     return render_template(
         "info.html",
         room=room,
-        students=students,
-        title=title,
+        students=tables.STUDENTS.rows(room_id=room.id, order_by=[Student.id]),
+        title=tables.STUDENTS.titles,
         form=form,
-        move=move.all(),
-        move_title=move_title,
+        move=tables.MY_MOVES.rows(student_id=current_user.id, order_by=[Move.id]),
+        move_title=tables.MY_MOVES.titles,
     )
 
 
@@ -266,16 +204,26 @@ def report():
     form = ReportForm()
     if form.validate_on_submit():
         file = form.picture.data
-        file.save(os.path.join(os.getcwd(), f"dormitory/static/upload/{file.filename}"))
+        picture = None
+        if file and file.filename:
+            try:
+                picture = uploads.store.save(file.stream, file.filename)
+            except uploads.UploadTooLarge:
+                flash("图片过大，提交失败！", category="danger")
+                return redirect(url_for("report"))
+            except uploads.UnsupportedType:
+                flash("图片格式不支持，提交失败！", category="danger")
+                return redirect(url_for("report"))
         try:
             fix = Fix(
                 student_id=current_user.id,
                 room_id=current_user.room_id,
                 category=form.category.data,
                 content=form.content.data,
-                picture=f"/static/upload/{file.filename}",
+                picture=picture,
             )
             db.session.add(fix)
+            thumbnails.submit(picture)
             db.session.commit()
             flash("报修已提交！", category="info")
         except:
@@ -284,31 +232,17 @@ def report():
         return redirect(url_for("report"))
 
     page = request.args.get("page", 1, type=int)
-    pagination = Fix.query.filter_by(student_id=current_user.id).paginate(
-        page=page, per_page=5
+    pagination = paginate(
+        tables.MY_FIXES.select(student_id=current_user.id),
+        [Fix.submit_time, Fix.id],
+        page,
     )
-    fixes = []
-    for fix in pagination.items:
-        fixes.append(
-            {
-                "id": fix.id,
-                "room_id": fix.room_id,
-                "category": fix.category,
-                "content": fix.content,
-                "submit_time": fix.submit_time,
-                "status": fix.status,
-            }
-        )
-    title = [
-        ("id", "报修编号"),
-        ("room_id", "房间号"),
-        ("category", "类别"),
-        ("content", "内容"),
-        ("submit_time", "提交时间"),
-        ("status", "状态"),
-    ]
     return render_template(
-        "report.html", form=form, fix=fixes, title=title, pagination=pagination
+        "report.html",
+        form=form,
+        fix=pagination.items,
+        title=tables.MY_FIXES.titles,
+        pagination=pagination,
     )
 
 
@@ -349,34 +283,16 @@ def visit():
             flash("出现错误，提交失败！", category="danger")
 
     page = request.args.get("page", 1, type=int)
-    pagination = Visitor.query.filter_by(student_id=current_user.id).paginate(
-        page=page, per_page=5
+    pagination = paginate(
+        tables.MY_VISITORS.select(student_id=current_user.id), [Visitor.id], page
     )
-    visitors = []
-    for visitor in pagination.items:
-        visitors.append(
-            {
-                "id": visitor.id,
-                "name": visitor.name,
-                "room_id": visitor.room_id,
-                "gender": visitor.gender,
-                "phone": visitor.phone,
-                "visit_time": visitor.visit_time,
-                "leave_time": visitor.leave_time,
-            }
-        )
-    title = [
-        ("id", "访客编号"),
-        ("name", "访客姓名"),
-        ("room_id", "房间号"),
-        ("gender", "性别"),
-        ("phone", "电话"),
-        ("visit_time", "访问时间"),
-        ("leave_time", "离开时间"),
-    ]
 
     return render_template(
-        "visit.html", form=form, visitor=visitors, title=title, pagination=pagination
+        "visit.html",
+        form=form,
+        visitor=pagination.items,
+        title=tables.MY_VISITORS.titles,
+        pagination=pagination,
     )
 
 
@@ -415,61 +331,22 @@ def manage():
     dorm_id = current_user.dorm_id
     dorm = Dorm.query.get(dorm_id)
     page = request.args.get("page", 1, type=int)
-    pagination = Room.query.filter_by(dorm_id=dorm_id).paginate(page=page, per_page=5)
-    rooms = []
-    for room in pagination.items:
-        rooms.append(
-            {
-                "id": room.id,
-                "level": room.level,
-                "spaces": room.spaces,
-                "residents": room.residents,
-            }
-        )
-    title = [
-        ("id", "房间号"),
-        ("level", "楼层"),
-        ("spaces", "床位数"),
-        ("residents", "入住人数"),
-    ]
+    pagination = paginate(tables.ROOMS.select(dorm_id=dorm_id), [Room.id], page)
 
     move_page = request.args.get("move_page", 1, type=int)
-    move_pagination = (
-        Move.query.join(Student)
-        .join(Room)
-        .filter(Room.dorm_id == dorm_id)
-        .paginate(page=move_page, per_page=5)
+    move_pagination = paginate(
+        tables.MOVES.select(in_dorm(Move, dorm_id)),
+        [Move.submit_time, Move.id],
+        move_page,
     )
-    moves = []
-    for move in move_pagination.items:
-        moves.append(
-            {
-                "id": move.id,
-                "student_id": move.student_id,
-                "original_room_id": move.original_room_id,
-                "target_room_id": move.target_room_id,
-                "reason": move.reason,
-                "submit_time": move.submit_time,
-                "status": move.status,
-            }
-        )
-    move_title = [
-        ("id", "申请编号"),
-        ("student_id", "学号"),
-        ("original_room_id", "原房间号"),
-        ("target_room_id", "目标房间号"),
-        ("reason", "原因"),
-        ("submit_time", "提交时间"),
-        ("status", "状态"),
-    ]
     return render_template(
         "manage.html",
         dorm=dorm,
-        rooms=rooms,
-        title=title,
+        rooms=pagination.items,
+        title=tables.ROOMS.titles,
         pagination=pagination,
-        moves=moves,
-        move_title=move_title,
+        moves=move_pagination.items,
+        move_title=tables.MOVES.titles,
         move_pagination=move_pagination,
     )
 
@@ -524,28 +401,12 @@ def room_info(room_id):
     form.level.data = room.level
     form.spaces.data = room.spaces
 
-    students = []
-    for student in room.students:
-        students.append(
-            {
-                "id": student.id,
-                "name": student.name,
-                "age": student.age,
-                "phone": student.phone,
-                "major": student.major,
-                "grade": student.grade,
-            }
-        )
-    title = [
-        ("id", "学号"),
-        ("name", "姓名"),
-        ("age", "年龄"),
-        ("phone", "电话"),
-        ("major", "专业"),
-        ("grade", "年级"),
-    ]
     return render_template(
-        "room_info.html", room=room, students=students, title=title, form=form
+        "room_info.html",
+        room=room,
+        students=tables.STUDENTS.rows(room_id=room.id, order_by=[Student.id]),
+        title=tables.STUDENTS.titles,
+        form=form,
     )
 
 
@@ -575,6 +436,13 @@ def new_student(room_id):
         if Student.query.get(form.id.data):
             flash("学号已存在！添加失败", category="danger")
             return redirect(url_for("new_student", room_id=room_id))
+        # Lock the room until the commit, so concurrent additions see each
+        # other's residents and cannot overbook it.
+        db.session.refresh(room, with_for_update=True)
+        if room.spaces - room.residents < 1:
+            db.session.rollback()
+            flash("房间床位不足！", category="danger")
+            return redirect(url_for("room_info", room_id=room_id))
         try:
             student = Student(
                 id=form.id.data,
@@ -614,6 +482,7 @@ def delete_student(student_id):
             db.session.delete(move)
         db.session.delete(student)
         db.session.commit()
+        forget(Student, student_id)
         flash("删除成功！", category="info")
     except:
         db.session.rollback()
@@ -632,36 +501,78 @@ def move_info(move_id):
     if current_user.__class__ == Student:
         return redirect(url_for("index"))
     move = Move.query.get_or_404(move_id)
-    student = Student.query.get(move.student_id)
-    if student.room.dorm_id != current_user.dorm_id:
+    if dorm_of(move) != current_user.dorm_id:
         return redirect(url_for("index"))
     form = MoveManageForm()
     if form.validate_on_submit():
         if form.reject.data:
             try:
-                move.status = "已拒绝"
-                db.session.commit()
-                flash("已拒绝！", category="info")
+                if moves.reject([move_id], current_user.dorm_id):
+                    flash("已拒绝！", category="info")
+                else:
+                    flash("该申请已被处理！", category="warning")
             except:
                 db.session.rollback()
                 flash("出现错误，拒绝失败！", category="danger")
 
         if form.agree.data:
-            room = Room.query.get(move.target_room_id)
-            if room.spaces - room.residents < 1:
-                flash("目标房间床位不足！", category="danger")
-                return redirect(url_for("move_info", move_id=move_id))
             try:
-                move.status = "已同意"
-                student.room_id = move.target_room_id
-                db.session.commit()
-                flash("已同意！", category="info")
+                approved, full, _ = moves.approve([move_id], current_user.dorm_id)
+                if approved:
+                    flash("已同意！", category="info")
+                elif full:
+                    flash("目标房间床位不足！", category="danger")
+                else:
+                    flash("该申请已被处理！", category="warning")
             except:
                 db.session.rollback()
                 flash("出现错误，同意失败！", category="danger")
 
         return redirect(url_for("move_info", move_id=move_id))
-    return render_template("move.html", move=move, student=student, form=form)
+    return render_template("move.html", move=move, form=form)
+
+
+class MovesManageForm(FlaskForm):
+    moves = SelectMultipleField("转宿申请", coerce=int, validators=[DataRequired()])
+    agree = SubmitField("全部同意")
+    reject = SubmitField("全部拒绝")
+
+
+@app.route("/moves", methods=["GET", "POST"])
+@login_required
+def moves_manage():
+    if current_user.__class__ == Student:
+        return redirect(url_for("index"))
+    pending = moves.pending(current_user.dorm_id)
+    form = MovesManageForm()
+    form.moves.choices = [
+        (m.id, f"{m.id}: {m.student_id} {m.original_room_id} → {m.target_room_id}")
+        for m in pending
+    ]
+    if form.validate_on_submit():
+        if form.reject.data:
+            try:
+                rejected = moves.reject(form.moves.data, current_user.dorm_id)
+                flash(f"已拒绝{len(rejected)}条申请！", category="info")
+            except:
+                db.session.rollback()
+                flash("出现错误，拒绝失败！", category="danger")
+
+        if form.agree.data:
+            try:
+                approved, full, _ = moves.approve(form.moves.data, current_user.dorm_id)
+                flash(f"已同意{len(approved)}条申请！", category="info")
+                if full:
+                    flash(
+                        f"目标房间床位不足：{', '.join(map(str, full))}",
+                        category="danger",
+                    )
+            except:
+                db.session.rollback()
+                flash("出现错误，同意失败！", category="danger")
+
+        return redirect(url_for("moves_manage"))
+    return render_template("moves.html", form=form, pending=pending)
 
 
 class NewRoomForm(FlaskForm):
@@ -713,37 +624,18 @@ def fix():
         return redirect(url_for("index"))
     page = request.args.get("page", 1, type=int)
     dorm_id = current_user.dorm_id
-    pagination = (
-        db.session.query(Fix)
-        .join(Room)
-        .filter(Room.dorm_id == dorm_id)
-        .paginate(page=page, per_page=5)
+    pagination = paginate(
+        tables.FIXES.select(in_dorm(Fix, dorm_id)),
+        [Fix.submit_time, Fix.id],
+        page,
     )
-    fixes = []
-    for fix in pagination.items:
-        fixes.append(
-            {
-                "id": fix.id,
-                "student_id": fix.student_id,
-                "room_id": fix.room_id,
-                "category": fix.category,
-                "content": fix.content,
-                "submit_time": fix.submit_time,
-                "status": fix.status,
-            }
-        )
-    title = [
-        ("id", "报修编号"),
-        ("student_id", "学号"),
-        ("room_id", "房间号"),
-        ("category", "类别"),
-        ("content", "内容"),
-        ("submit_time", "提交时间"),
-        ("status", "状态"),
-    ]
 
     return render_template(
-        "fixes.html", dorm_id=dorm_id, fix=fixes, title=title, pagination=pagination
+        "fixes.html",
+        dorm_id=dorm_id,
+        fix=pagination.items,
+        title=tables.FIXES.titles,
+        pagination=pagination,
     )
 
 
@@ -755,13 +647,9 @@ class FixInfoForm(FlaskForm):
 @login_required
 def fix_info(fix_id):
     fix = Fix.query.get_or_404(fix_id)
-    student = Student.query.get(fix.student_id)
-    if (
-        current_user.__class__ == Manager
-        and student.room.dorm_id != current_user.dorm_id
-    ):
+    if current_user.__class__ == Manager and dorm_of(fix) != current_user.dorm_id:
         return redirect(url_for("index"))
-    if current_user.__class__ == Student and student.id != current_user.id:
+    if current_user.__class__ == Student and fix.student_id != current_user.id:
         return redirect(url_for("index"))
     if fix.status == "未处理":
         form = FixInfoForm()
@@ -774,5 +662,5 @@ def fix_info(fix_id):
                 db.session.rollback()
                 flash("出现错误，处理失败！", category="danger")
             return redirect(url_for("fix_info", fix_id=fix_id))
-        return render_template("fix_info.html", fix=fix, student=student, form=form)
-    return render_template("fix_info.html", fix=fix, student=student)
+        return render_template("fix_info.html", fix=fix, form=form)
+    return render_template("fix_info.html", fix=fix)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its database URL at import time.
+_db_file = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from dormitory import app as flask_app, db  # noqa: E402
+from dormitory.commands import generate  # noqa: E402
+from dormitory.migrations import create_all  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        PASSWORD_HASH_WORKERS=0,
+        RESPONSE_CACHE="memory",
+    )
+    with flask_app.app_context():
+        db.drop_all()
+        create_all()
+        generate(dorms=2, students=10, fixes=0, visitors=0, moves=0)
+    # Requests push their own app context, so ``g`` does not leak between
+    # clients.
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login_manager(client, dorm_id=1):
+    from dormitory.models import Manager
+
+    with client.application.app_context():
+        manager = Manager.query.filter_by(dorm_id=dorm_id).first()
+    response = client.post(
+        "/login", data=dict(username=manager.id, password="12345678", manager="y")
+    )
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,39 @@
+from conftest import login_manager
+
+from dormitory.models import Room
+
+
+def _first_room(app, dorm_id=1):
+    with app.app_context():
+        return Room.query.filter_by(dorm_id=dorm_id).order_by(Room.id).first()
+
+
+def test_room_edit_invalidates_dorm_page(app, client):
+    # Logging in upgrades the manager's hash, which changes the page too.
+    manager = login_manager(app.test_client())
+    room = _first_room(app)
+    assert client.get("/dorm/1").headers["X-Cache"] == "MISS"
+    assert client.get("/dorm/1").headers["X-Cache"] == "HIT"
+
+    response = manager.post(
+        f"/room/{room.id}",
+        data=dict(id=room.id, level=room.level + 40, spaces=room.spaces, submit="y"),
+    )
+    assert response.status_code == 302
+
+    assert client.get("/dorm/1").headers["X-Cache"] == "MISS"
+
+
+def test_room_rename_invalidates_dorm_page(app, client):
+    manager = login_manager(app.test_client())
+    room = _first_room(app)
+    client.get("/dorm/1")
+    assert client.get("/dorm/1").headers["X-Cache"] == "HIT"
+
+    response = manager.post(
+        f"/room/{room.id}",
+        data=dict(id="1-0000", level=room.level, spaces=room.spaces, submit="y"),
+    )
+    assert response.status_code == 302
+
+    assert client.get("/dorm/1").headers["X-Cache"] == "MISS"
@@ -0,0 +1,32 @@
+import io
+
+import pytest
+
+from dormitory import db
+from dormitory.models import Student
+
+
+@pytest.fixture
+def student(app):
+    with app.app_context():
+        student_id = db.session.scalar(db.select(Student.id))
+    client = app.test_client()
+    client.post("/login", data=dict(username=student_id, password="12345678"))
+    app.config["MAX_CONTENT_LENGTH"] = 1000
+    yield client
+    app.config["MAX_CONTENT_LENGTH"] = 2 * app.config["UPLOAD_MAX_BYTES"]
+
+
+def test_oversized_report_redirects_back(student):
+    response = student.post(
+        "/report",
+        data=dict(category="水电", picture=(io.BytesIO(b"x" * 5000), "a.jpg")),
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 302
+    assert response.location == "/report"
+
+
+def test_oversized_request_elsewhere_is_413(student):
+    response = student.post("/visit", data=dict(reason="x" * 5000))
+    assert response.status_code == 413
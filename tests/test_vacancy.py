@@ -0,0 +1,22 @@
+from conftest import login_manager
+
+from dormitory import db, vacancy
+from dormitory.models import Room
+
+
+def test_room_rename_refreshes_free_rooms(app):
+    manager = login_manager(app.test_client())
+    with app.app_context():
+        room_id = vacancy.rooms(1)[0]
+        room = db.session.get(Room, room_id)
+
+    response = manager.post(
+        f"/room/{room.id}",
+        data=dict(id="1-0000", level=room.level, spaces=room.spaces, submit="y"),
+    )
+    assert response.status_code == 302
+
+    with app.app_context():
+        free = vacancy.rooms(1)
+    assert "1-0000" in free
+    assert room_id not in free